@@ -1,21 +1,35 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, g, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import asyncio
 import nest_asyncio
-import time
-import threading
 import traceback
 import os
+import json
+import time
+import threading
 from datetime import datetime
 
 # Import our custom modules
 from ib_client import IBClient
 from utils import safe_float_conversion, format_currency
+from snapshot_store import SnapshotStore
+from scanner import ChainScanner
+from history import PortfolioHistory, RESOLUTIONS
+from scheduler import RefreshScheduler, PORTFOLIO_INTERVALS, OPTIONS_INTERVALS
+from profiling import span, start_recording, stop_recording, last_profiles, SamplingProfiler
 
 nest_asyncio.apply()
 
+# Time JSON encoding as its own stage
+class TracedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with span('flask.json_encode'):
+            return super().dumps(obj, **kwargs)
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = TracedJSONProvider(app)
 CORS(app)  # Enable CORS for all routes
 
 # Global variables
@@ -26,7 +40,17 @@ portfolio_data = {
     'last_update': None
 }
 options_data = {}
-stop_event = threading.Event()
+# Lookups from conId to cached option rows, for coalesced tick updates
+option_rows_by_conid = {}
+option_keys_by_conid = {}
+# Held while options_data entries and their conId index change together
+options_lock = threading.Lock()
+refresh_scheduler = RefreshScheduler()
+portfolio_history = PortfolioHistory()
+# Stop refreshing an options key nobody has polled for this long (seconds)
+OPTIONS_EXPIRE_AFTER = 600
+sampling_profiler = SamplingProfiler()
+snapshot_store = SnapshotStore()
 
 # Configure event loop for the main thread
 if not asyncio.get_event_loop().is_running():
@@ -42,95 +66,313 @@ def setup_asyncio_event_loop():
         asyncio.set_event_loop(loop)
     return loop
 
-# Background thread to update portfolio data
-# Modify the update_portfolio_data function in app.py
+def publish_options(key, entry):
+    """Index entry's option rows by conId, then swap it into options_data[key]"""
+    rows = {}
+    for side in ('calls', 'puts'):
+        for index, row in enumerate(entry[side]):
+            if row.get('conId'):
+                rows[row['conId']] = (side, index)
+    
+    # Tick updates never see the new entry with the old entry's row positions
+    with options_lock:
+        for con_id in option_rows_by_conid.get(key, {}):
+            option_keys_by_conid.get(con_id, set()).discard(key)
+        for con_id in rows:
+            option_keys_by_conid.setdefault(con_id, set()).add(key)
+        option_rows_by_conid[key] = rows
+        options_data[key] = entry
+
+def expire_options(ticker, expiration):
+    """Flag a chain whose refresh job expired; it is served stale until refreshed again"""
+    key = f"{ticker}_{expiration}"
+    if ib_client:
+        ib_client.cancel_options_data(ticker, expiration)
+    with options_lock:
+        entry = options_data.get(key)
+        if entry is not None:
+            entry['stale'] = True
+
+def apply_tick_updates(tickers):
+    """Refresh cached option rows and stock values from a coalesced set of tickers"""
+    with options_lock:
+        portfolio_changed = _apply_tick_updates(tickers)
+    if portfolio_changed:
+        update_portfolio_totals()
+
+def _apply_tick_updates(tickers):
+    now = datetime.now().isoformat()
+    portfolio_changed = False
+    
+    # Apply underlying prices first so option rows derive from the new spot
+    ordered = sorted(tickers.items(), key=lambda item: item[1].contract.secType != 'STK')
+    for con_id, ticker in ordered:
+        contract = ticker.contract
+        price = ticker.marketPrice()
+        
+        if contract.secType == 'STK':
+            if price is None or price != price or price <= 0:
+                continue
+            for key, entry in list(options_data.items()):
+                if key.split('_')[0] == contract.symbol:
+                    entry['stock_price'] = price
+                    entry['last_update'] = now
+            for row in portfolio_data.get('underlying_positions') or []:
+                if row['Symbol'] != contract.symbol:
+                    continue
+                if row['Stock Count']:
+                    row['Underlying Price'] = price
+                    row['Stock Value'] = row['Stock Count'] * price
+                    row['Notional Position Value (NPV)'] = row['Stock Value']
+                    portfolio_changed = True
+                elif row['Option Notional (Shares)']:
+                    row['Underlying Price'] = price
+                    row['Option Notional Value'] = row['Option Notional (Shares)'] * price
+                    row['Notional Position Value (NPV)'] = row['Option Notional Value']
+                    portfolio_changed = True
+        
+        elif contract.secType == 'OPT':
+            for key in list(option_keys_by_conid.get(con_id, ())):
+                entry = options_data.get(key)
+                location = option_rows_by_conid.get(key, {}).get(con_id)
+                if entry is None or location is None:
+                    continue
+                side, index = location
+                entry[side][index] = ib_client.option_row(ticker, entry['stock_price'])
+                entry['last_update'] = now
+    
+    return portfolio_changed
+
+def load_snapshots():
+    """Serve the last persisted snapshots, marked stale, until fresh data arrives"""
+    global portfolio_data
+    
+    today = datetime.now().strftime('%Y%m%d')
+    expired = []
+    for key, (data, saved_at) in snapshot_store.load_all().items():
+        data['stale'] = True
+        data['snapshot_time'] = saved_at
+        if key == 'portfolio':
+            portfolio_data = data
+        elif key.startswith('options:'):
+            options_key = key[len('options:'):]
+            # Keys are <TICKER>_<YYYYMMDD>; a chain past its expiration is never refreshed again
+            if options_key.rsplit('_', 1)[-1] < today:
+                expired.append(key)
+                continue
+            publish_options(options_key, data)
+    snapshot_store.delete(expired)
+    
+    print(f"Loaded {len(options_data)} options snapshots ({len(expired)} expired dropped), "
+          f"portfolio snapshot: {portfolio_data.get('stale', False)}")
+
+def option_position_row(item, quote):
+    """Portfolio row for one option position, notional in delta-adjusted shares
+    
+    Option Notional (Shares) is |delta| x multiplier x position, in shares as
+    the column says (IBClient.async_get_portfolio_data divides it by 100 into
+    contract equivalents), and is valued at the underlying price. Without a
+    quote the notional is unknown and left at 0. Data Type and Underlying
+    Data Type show whether the quotes behind it are live, delayed or frozen.
+    """
+    multiplier = safe_float_conversion(item.contract.multiplier) or 100
+    delta = quote['delta'] if quote else None
+    spot = quote['underlying_price'] if quote else None
+    shares = abs(delta) * multiplier * item.position if delta is not None and spot else 0
+    return {
+        'Symbol': item.contract.symbol,
+        'Stock Count': 0,
+        'Stock Value': 0,
+        'Option Notional (Shares)': shares,
+        'Option Notional Value': shares * spot if shares else 0,
+        'Option Actual Value': item.marketValue,
+        'Underlying Price': spot,
+        'Notional Position Value (NPV)': shares * spot if shares else 0,
+        'Data Type': quote['data_type'] if quote else None,
+        'Underlying Data Type': quote['underlying_data_type'] if quote else None
+    }
+
+def update_portfolio_totals():
+    """Recompute NGAV/NLR from the position rows and record them in portfolio_history
+    
+    NGAV is gross: the absolute notional of every position, long or short,
+    summed. Per-underlying NPV in the history is gross the same way.
+    """
+    account_summary = portfolio_data.get('account_summary')
+    positions = portfolio_data.get('underlying_positions')
+    if not account_summary or positions is None:
+        return None
+    
+    npv_by_symbol = {}
+    for row in positions:
+        npv = abs(row['Notional Position Value (NPV)'] or 0)
+        npv_by_symbol[row['Symbol']] = npv_by_symbol.get(row['Symbol'], 0) + npv
+    
+    nlv = safe_float_conversion(account_summary['NetLiquidation']['Value'])
+    ngav = sum(npv_by_symbol.values())
+    nlr = ngav / nlv if nlv > 0 else 0
+    account_summary['NGAV (Notional Gross Asset Value)'] = {'Value': str(ngav)}
+    account_summary['NLR (Notional Leverage Ratio)'] = {'Value': f"{nlr:.2f}"}
+    
+    portfolio_history.record(time.time(), nlv, ngav, nlr, npv_by_symbol)
+    return ngav
+
+# Refresh job for portfolio data, run by refresh_scheduler
 def update_portfolio_data():
+    """Refresh portfolio_data once; returns NGAV for the scheduler"""
     setup_asyncio_event_loop()
     global portfolio_data, ib_client
     
-    while not stop_event.is_set():
-        if ib_client and ib_client.is_connected():
-            try:
-                print("Attempting to get portfolio data...")
-                
-                # Use direct portfolio access
+    if ib_client and ib_client.is_connected():
+        recorder = start_recording()
+        try:
+            print("Attempting to get portfolio data...")
+            
+            # Use direct portfolio access
+            with span('portfolio.managed_accounts'):
                 accounts = ib_client.ib.managedAccounts()
-                if accounts:
-                    account_id = accounts[0]
-                    print(f"Using account: {account_id}")
-                    
-                    # Create a basic account summary with some values
-                    account_summary = {
-                        'NetLiquidation': {'Value': '0'},
-                        'GrossPositionValue': {'Value': '0'},
-                        'BuyingPower': {'Value': '0'},
+            if accounts:
+                account_id = accounts[0]
+                print(f"Using account: {account_id}")
+                
+                # Account values are kept up to date by ib_insync; no request is made
+                with span('portfolio.account_values'):
+                    account_values = {
+                        v.tag: v.value for v in ib_client.ib.accountValues()
+                        if v.currency in ('USD', 'BASE')
                     }
-                    
-                    # Get portfolio directly
+                account_summary = {
+                    'NetLiquidation': {'Value': account_values.get('NetLiquidation', '0')},
+                    'GrossPositionValue': {'Value': account_values.get('GrossPositionValue', '0')},
+                    'BuyingPower': {'Value': account_values.get('BuyingPower', '0')},
+                }
+                
+                # Get portfolio directly
+                with span('portfolio.portfolio'):
                     portfolio_items = ib_client.ib.portfolio()
-                    print(f"Portfolio items received: {len(portfolio_items)}")
-                    
-                    # Process portfolio items
-                    underlying_data = []
-                    for item in portfolio_items:
-                        print(f"Processing item: {item.contract.symbol}")
-                        underlying_data.append({
-                            'Symbol': item.contract.symbol,
-                            'Stock Count': item.position if item.contract.secType == 'STK' else 0,
-                            'Stock Value': item.marketValue if item.contract.secType == 'STK' else 0,
-                            'Option Notional (Shares)': 0,  # Placeholder 
-                            'Option Notional Value': 0,
-                            'Option Actual Value': item.marketValue if item.contract.secType == 'OPT' else 0,
-                            'Underlying Price': item.marketPrice if item.marketPrice else item.averageCost,
-                            'Notional Position Value (NPV)': item.marketValue
-                        })
-                    
-                    # Update portfolio data
-                    portfolio_data = {
-                        'account_summary': account_summary,
-                        'underlying_positions': underlying_data,
-                        'last_update': datetime.now().isoformat()
-                    }
-                    
-                    print("Portfolio data set successfully")
+                print(f"Portfolio items received: {len(portfolio_items)}")
+                
+                # Option notional needs live deltas; quoted in one batch like /api/exposure
+                option_items = [item for item in portfolio_items if item.contract.secType == 'OPT']
+                with span('portfolio.option_deltas'):
+                    option_deltas = ib_client.get_option_deltas(option_items)
                 
-            except Exception as e:
-                print(f"Error updating portfolio data: {e}")
-                print(f"Full traceback: {traceback.format_exc()}")
+                # Process portfolio items
+                underlying_data = []
+                for item in portfolio_items:
+                    print(f"Processing item: {item.contract.symbol}")
+                    if item.contract.secType == 'OPT':
+                        underlying_data.append(option_position_row(item, option_deltas.get(item.contract.conId)))
+                        continue
+                    underlying_data.append({
+                        'Symbol': item.contract.symbol,
+                        'Stock Count': item.position if item.contract.secType == 'STK' else 0,
+                        'Stock Value': item.marketValue if item.contract.secType == 'STK' else 0,
+                        'Option Notional (Shares)': 0,
+                        'Option Notional Value': 0,
+                        'Option Actual Value': 0,
+                        'Underlying Price': item.marketPrice if item.marketPrice else item.averageCost,
+                        'Notional Position Value (NPV)': item.marketValue
+                    })
                 
-        # Sleep until next update (15 seconds)
-        time.sleep(15)
+                # Update portfolio data
+                portfolio_data = {
+                    'account_summary': account_summary,
+                    'underlying_positions': underlying_data,
+                    'last_update': datetime.now().isoformat()
+                }
+                
+                ngav = update_portfolio_totals()
+                with span('portfolio.snapshot_save'):
+                    snapshot_store.save('portfolio', portfolio_data)
+                print("Portfolio data set successfully")
+                
+                return ngav
+            
+        except Exception as e:
+            print(f"Error updating portfolio data: {e}")
+            print(f"Full traceback: {traceback.format_exc()}")
+        finally:
+            last_profiles['portfolio'] = stop_recording(recorder)
+    
+    return None
 
-# Function to update options data in background
+# Refresh job for one options key, run by refresh_scheduler
 def update_options_data(ticker, expiration):
+    """Refresh options_data for one ticker/expiration; returns the stock price"""
     setup_asyncio_event_loop()
     global options_data, ib_client
     
     last_key = f"{ticker}_{expiration}"
     
-    while not stop_event.is_set():
-        if ib_client and ib_client.is_connected():
+    if ib_client and ib_client.is_connected():
+        try:
+            recorder = start_recording()
             try:
-                # Check if request is still active
-                current_key = request.args.get('options_key')
-                if not current_key or current_key != last_key:
-                    # Stop updating if request has changed or ended
-                    break
-                    
-                stock_price, calls, puts = ib_client.get_options_for_expiration(ticker, expiration)
-                
-                if stock_price is not None and calls and puts:
-                    options_data[last_key] = {
-                        'stock_price': stock_price,
-                        'calls': calls,
-                        'puts': puts,
-                        'last_update': datetime.now().isoformat()
-                    }
-            except Exception as e:
-                print(f"Error updating options data: {e}")
-                
-        # Sleep until next update (5 seconds)
-        time.sleep(5)
+                stock_price, calls, puts, stock_data_type = ib_client.get_options_for_expiration(ticker, expiration)
+            finally:
+                last_profiles[f'options:{last_key}'] = stop_recording(recorder)
+            
+            if stock_price is not None and calls and puts:
+                entry = {
+                    'stock_price': stock_price,
+                    'stock_data_type': stock_data_type,
+                    'calls': calls,
+                    'puts': puts,
+                    'last_update': datetime.now().isoformat()
+                }
+                publish_options(last_key, entry)
+                snapshot_store.save(f'options:{last_key}', entry)
+                return stock_price
+        except Exception as e:
+            print(f"Error updating options data: {e}")
+    
+    return None
+
+# Per-request stage timing (?profile=1)
+@app.before_request
+def start_request_profile():
+    if request.args.get('profile') == '1':
+        g.profile_recorder = start_recording()
+        g.profile_args = request.args.to_dict()
+    g.handler_span = span(f'flask.handler.{request.endpoint}')
+    g.handler_span.__enter__()
+
+@app.after_request
+def attach_request_profile(response):
+    handler_span = g.pop('handler_span', None)
+    if handler_span is not None:
+        handler_span.__exit__(None, None, None)
+    
+    recorder = g.pop('profile_recorder', None)
+    if recorder is None:
+        return response
+    
+    profile = stop_recording(recorder)
+    data = response.get_json(silent=True)
+    if isinstance(data, dict):
+        # Background updaters do the IB work for these endpoints
+        if request.endpoint == 'get_portfolio':
+            profile['background'] = last_profiles.get('portfolio')
+        elif request.endpoint == 'get_options':
+            args = g.profile_args
+            key = f"{args.get('ticker')}_{args.get('expiration')}"
+            profile['background'] = last_profiles.get(f'options:{key}')
+        data['profile'] = profile
+        response.set_data(app.json.dumps(data))
+    return response
+
+@app.teardown_request
+def discard_request_profile(exc):
+    # Unhandled errors skip after_request; close the handler span and don't
+    # leak the recorder into the next request
+    handler_span = g.pop('handler_span', None)
+    if handler_span is not None:
+        handler_span.__exit__(type(exc) if exc else None, exc, None)
+    
+    recorder = g.pop('profile_recorder', None)
+    if recorder is not None:
+        stop_recording(recorder)
 
 # Routes
 @app.route('/api/connect', methods=['POST'])
@@ -145,16 +387,15 @@ def connect():
     # Initialize IB client if not already initialized
     if not ib_client:
         ib_client = IBClient()
+        ib_client.tick_coalescer.add_listener(apply_tick_updates)
     
     # Try to connect
     success = ib_client.connect(host, port, client_id)
     
     if success:
-        # Start portfolio update thread if not already running
-        if not any(t.name == 'portfolio_updater' for t in threading.enumerate()):
-            portfolio_thread = threading.Thread(target=update_portfolio_data, name='portfolio_updater')
-            portfolio_thread.daemon = True
-            portfolio_thread.start()
+        # Start refreshing portfolio data if not already scheduled
+        refresh_scheduler.register('portfolio', update_portfolio_data, PORTFOLIO_INTERVALS)
+        refresh_scheduler.start()
         
         return jsonify({"status": "connected", "message": "Successfully connected to Interactive Brokers"})
     else:
@@ -188,13 +429,56 @@ def get_portfolio():
     global portfolio_data, ib_client
     
     if not ib_client or not ib_client.is_connected():
+        # A restored snapshot is still worth serving before /api/connect
+        if portfolio_data.get('stale'):
+            return jsonify(portfolio_data)
         return jsonify({"status": "error", "message": "Not connected to Interactive Brokers"}), 400
-        
+    
+    refresh_scheduler.touch('portfolio')
+    
     if not portfolio_data.get('account_summary'):
         return jsonify({"status": "waiting", "message": "Portfolio data not yet available"}), 202
         
     return jsonify(portfolio_data)
 
+@app.route('/api/exposure', methods=['GET'])
+def get_exposure():
+    global ib_client
+    
+    if not ib_client or not ib_client.is_connected():
+        return jsonify({"status": "error", "message": "Not connected to Interactive Brokers"}), 400
+    
+    exposure = ib_client.get_portfolio_exposure()
+    
+    if exposure is None:
+        return jsonify({"status": "error", "message": "Failed to retrieve portfolio exposure"}), 500
+    
+    exposure['last_update'] = datetime.now().isoformat()
+    return jsonify(exposure)
+
+@app.route('/api/portfolio/history', methods=['GET'])
+def get_portfolio_history():
+    resolution = request.args.get('resolution', '1m')
+    if resolution not in RESOLUTIONS:
+        return jsonify({"status": "error", "message": f"Resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+    
+    # Window bounds as epoch seconds or ISO timestamps; defaults to everything kept
+    try:
+        start = parse_timestamp(request.args.get('start'), 0.0)
+        end = parse_timestamp(request.args.get('end'), time.time())
+    except ValueError:
+        return jsonify({"status": "error", "message": "start and end must be epoch seconds or ISO timestamps"}), 400
+    
+    return jsonify(portfolio_history.query(resolution, start, end))
+
+def parse_timestamp(value, default):
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
 @app.route('/api/option_chain', methods=['GET'])
 def get_option_chain():
     global ib_client
@@ -237,9 +521,6 @@ def get_option_chain():
 def get_options():
     global options_data, ib_client
     
-    if not ib_client or not ib_client.is_connected():
-        return jsonify({"status": "error", "message": "Not connected to Interactive Brokers"}), 400
-        
     ticker = request.args.get('ticker')
     expiration = request.args.get('expiration')
     
@@ -247,29 +528,68 @@ def get_options():
         return jsonify({"status": "error", "message": "Ticker and expiration are required"}), 400
     
     key = f"{ticker}_{expiration}"
-    request.args = {'options_key': key}  # Store current request key
+    
+    if not ib_client or not ib_client.is_connected():
+        # A restored snapshot is still worth serving before /api/connect
+        if options_data.get(key, {}).get('stale'):
+            return jsonify(options_data[key])
+        return jsonify({"status": "error", "message": "Not connected to Interactive Brokers"}), 400
+    
+    # Schedule refreshes for this key if not already running; they stop
+    # once no client has asked for it in OPTIONS_EXPIRE_AFTER seconds
+    refresh_scheduler.register(
+        f'options:{key}',
+        lambda: update_options_data(ticker, expiration),
+        OPTIONS_INTERVALS,
+        expire_after=OPTIONS_EXPIRE_AFTER,
+        on_expire=lambda: expire_options(ticker, expiration)
+    )
+    refresh_scheduler.touch(f'options:{key}')
     
     # Check if we have cached data
     if key in options_data:
         return jsonify(options_data[key])
     
-    # Start a thread to update this data if not already running
-    option_thread_exists = any(t.name == f'options_updater_{key}' for t in threading.enumerate())
-    if not option_thread_exists:
-        options_thread = threading.Thread(
-            target=update_options_data, 
-            args=(ticker, expiration),
-            name=f'options_updater_{key}'
+    # Return temporary response while data is being fetched
+    return jsonify({"status": "loading", "message": "Fetching options data..."}), 202
+
+@app.route('/api/scan', methods=['POST'])
+def scan():
+    global ib_client
+    
+    if not ib_client or not ib_client.is_connected():
+        return jsonify({"status": "error", "message": "Not connected to Interactive Brokers"}), 400
+    
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object"}), 400
+    tickers = data.get('tickers', [])
+    if not isinstance(tickers, list) or not all(isinstance(t, str) for t in tickers):
+        return jsonify({"status": "error", "message": "tickers must be a list of symbols"}), 400
+    tickers = [t.strip().upper() for t in tickers if t.strip()]
+    if not tickers:
+        return jsonify({"status": "error", "message": "At least one ticker is required"}), 400
+    
+    try:
+        scanner = ChainScanner(
+            ib_client,
+            strike_count=int(data.get('strike_count', 10)),
+            min_dte=int(data.get('min_dte', 20)),
+            with_iv_rank=bool(data.get('iv_rank', False))
         )
-        options_thread.daemon = True
-        options_thread.start()
-        
-        # Return temporary response while data is being fetched
-        return jsonify({"status": "loading", "message": "Fetching options data..."}), 202
-    else:
-        # Still waiting for data
-        return jsonify({"status": "loading", "message": "Fetching options data..."}), 202
+        events = scanner.scan(
+            list(dict.fromkeys(tickers)),
+            filter_expr=data.get('filter'),
+            rank_by=data.get('rank_by'),
+            ascending=bool(data.get('ascending', False))
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     
+    # One JSON object per line, flushed as each batch of chains completes
+    lines = (json.dumps(event) + '\n' for event in events)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
 @app.route('/api/test_connection', methods=['GET'])
 def test_connection():
     global ib_client
@@ -361,12 +681,34 @@ def get_detailed_status():
             "message": str(e)
         }), 500
 
+@app.route('/api/scheduler', methods=['GET'])
+def get_scheduler_status():
+    return jsonify(refresh_scheduler.status())
+
+@app.route('/api/profiler', methods=['GET', 'POST'])
+def profiler():
+    if request.method == 'GET':
+        return jsonify(sampling_profiler.status())
+    
+    data = request.json or {}
+    if data.get('enabled'):
+        started = sampling_profiler.start(int(data.get('interval_ms', 10)))
+        message = "Sampling profiler started" if started else "Sampling profiler already running"
+        return jsonify({"status": "running", "message": message})
+    
+    output_path = sampling_profiler.stop()
+    if output_path is None:
+        return jsonify({"status": "warning", "message": "Sampling profiler is not running"})
+    return jsonify({"status": "stopped", "output": output_path})
+
 # Clean up resources when the app closes
 def cleanup():
-    global ib_client, stop_event
+    global ib_client
     
     # Signal threads to stop
-    stop_event.set()
+    refresh_scheduler.stop()
+    sampling_profiler.stop()
+    snapshot_store.close()
     
     # Disconnect from IB
     if ib_client and ib_client.is_connected():
@@ -378,6 +720,8 @@ def cleanup():
 import atexit
 atexit.register(cleanup)
 
+load_snapshots()
+
 if __name__ == '__main__':
     # Get port from environment or use default
     port = int(os.environ.get('PORT', 5001))
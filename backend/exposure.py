@@ -0,0 +1,84 @@
+import numpy as np
+from datetime import datetime
+
+# Days-to-expiry bucket edges; a position lands in the first bucket whose
+# upper edge is >= its DTE
+EXPIRY_BUCKET_EDGES = [7, 30, 90, 180]
+EXPIRY_BUCKET_LABELS = ['0-7d', '8-30d', '31-90d', '91-180d', '181d+']
+
+EXPOSURE_COLUMNS = ['Dollar Delta', 'Dollar Gamma', 'Vega', 'Theta']
+
+
+def _group_sums(keys, values):
+    """Sum each column of `values` per distinct key using bincount"""
+    labels, inverse = np.unique(keys, return_inverse=True)
+    sums = np.column_stack([
+        np.bincount(inverse, weights=column, minlength=len(labels))
+        for column in values.T
+    ]) if len(labels) else np.empty((0, values.shape[1]))
+    counts = np.bincount(inverse, minlength=len(labels))
+    return labels, sums, counts
+
+
+def _rows(key_name, labels, sums, counts):
+    rows = []
+    for label, sum_row, count in zip(labels, sums, counts):
+        row = {key_name: str(label), 'Positions': int(count)}
+        row.update({name: float(value) for name, value in zip(EXPOSURE_COLUMNS, sum_row)})
+        rows.append(row)
+    return rows
+
+
+def aggregate_exposure(positions, today=None):
+    """Aggregate per-position Greeks into dollar exposures by underlying and expiry bucket
+
+    Each position is a dict with Symbol, Expiry (YYYYMMDD), Position, Multiplier,
+    Underlying Price, Delta, Gamma, Vega and Theta. Missing Greeks should be NaN;
+    they are counted but contribute nothing to the sums.
+
+    Dollar Delta is the P&L for a $1 move scaled by spot (delta * qty * mult * spot),
+    Dollar Gamma is the change in Dollar Delta for a 1% move, Vega is dollars per
+    vol point and Theta is dollars per day.
+    """
+    today = today or datetime.now().date()
+    if not positions:
+        empty_totals = {name: 0.0 for name in EXPOSURE_COLUMNS}
+        return {'by_underlying': [], 'by_expiry': [], 'totals': empty_totals,
+                'positions': 0, 'missing_greeks': 0}
+
+    symbols = np.array([p['Symbol'] for p in positions])
+    dte = np.array([
+        (datetime.strptime(p['Expiry'][:8], '%Y%m%d').date() - today).days
+        for p in positions
+    ])
+    qty = np.array([p['Position'] for p in positions], dtype=float)
+    multiplier = np.array([p['Multiplier'] for p in positions], dtype=float)
+    spot = np.array([p['Underlying Price'] for p in positions], dtype=float)
+    greeks = np.array([[p['Delta'], p['Gamma'], p['Vega'], p['Theta']] for p in positions],
+                      dtype=float)
+
+    missing = np.isnan(greeks).any(axis=1) | np.isnan(spot)
+    size = qty * multiplier
+    exposures = np.column_stack([
+        greeks[:, 0] * size * spot,
+        greeks[:, 1] * size * spot * spot / 100.0,
+        greeks[:, 2] * size,
+        greeks[:, 3] * size,
+    ])
+    exposures[missing] = 0.0
+
+    underlying_labels, underlying_sums, underlying_counts = _group_sums(symbols, exposures)
+
+    bucket_index = np.digitize(dte, EXPIRY_BUCKET_EDGES, right=True)
+    bucket_labels, bucket_sums, bucket_counts = _group_sums(bucket_index, exposures)
+    bucket_names = [EXPIRY_BUCKET_LABELS[i] for i in bucket_labels]
+
+    totals = exposures.sum(axis=0)
+
+    return {
+        'by_underlying': _rows('Symbol', underlying_labels, underlying_sums, underlying_counts),
+        'by_expiry': _rows('Expiry Bucket', bucket_names, bucket_sums, bucket_counts),
+        'totals': {name: float(value) for name, value in zip(EXPOSURE_COLUMNS, totals)},
+        'positions': len(positions),
+        'missing_greeks': int(missing.sum()),
+    }
@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import contextvars
+import math
+import random
+import threading
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+from eventkit import Event
+from ib_insync import (AccountValue, Option, OptionChain, OptionComputation,
+                       PortfolioItem, Stock, Ticker)
+
+
+# Who is making IB requests (an endpoint or refresh job); set with FakeIB.source()
+_request_source = contextvars.ContextVar('ib_request_source', default='other')
+
+
+def _norm_cdf(x):
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
+
+
+class FakeIB:
+    """Offline stand-in for ib_insync.IB with synthetic quotes and Greeks
+
+    Implements the subset of the IB API that IBClient and app.py use, answers
+    immediately (plus an optional simulated latency) and counts every request
+    by method, and by the source set with `source()`, so load tests can report
+    IB request volume. Pass it to IBClient(ib=FakeIB()).
+    """
+
+    def __init__(self, symbols=('AAPL', 'MSFT', 'SPY', 'QQQ', 'NVDA'), strikes_per_chain=20,
+                 latency=0.0, seed=1):
+        self.symbols = list(symbols)
+        self.strikes_per_chain = strikes_per_chain
+        self.latency = latency
+        self.requests = Counter()
+        self.requests_by_source = defaultdict(Counter)
+        self.errorEvent = Event('errorEvent')
+        self.pendingTickersEvent = Event('pendingTickersEvent')
+        self._connected = False
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._con_ids = {}
+        self._contracts = {}
+        self._tickers = {}
+        self._spot = {symbol: 50.0 + 50 * i for i, symbol in enumerate(self.symbols)}
+        today = date.today()
+        self.expirations = [
+            (today + timedelta(days=days)).strftime('%Y%m%d') for days in (7, 14, 30, 60, 90, 180)
+        ]
+
+    def _count(self, method):
+        with self._lock:
+            self.requests[method] += 1
+            self.requests_by_source[_request_source.get()][method] += 1
+
+    @staticmethod
+    @contextlib.contextmanager
+    def source(name):
+        """Attribute requests made in this context (and tasks it starts) to `name`"""
+        token = _request_source.set(name)
+        try:
+            yield
+        finally:
+            _request_source.reset(token)
+
+    def _con_id(self, contract):
+        key = (contract.secType, contract.symbol, contract.lastTradeDateOrContractMonth,
+               contract.strike, contract.right)
+        with self._lock:
+            if key not in self._con_ids:
+                self._con_ids[key] = len(self._con_ids) + 1000
+                self._contracts[self._con_ids[key]] = contract
+            return self._con_ids[key]
+
+    async def _wait(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    # Connection
+    def connect(self, host='127.0.0.1', port=7497, clientId=1, readonly=False, **kwargs):
+        self._count('connect')
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def isConnected(self):
+        return self._connected
+
+    # Account
+    def managedAccounts(self):
+        self._count('managedAccounts')
+        return ['DU0000000']
+
+    def accountValues(self):
+        self._count('accountValues')
+        return [
+            AccountValue('DU0000000', 'NetLiquidation', '1000000', 'USD', ''),
+            AccountValue('DU0000000', 'GrossPositionValue', '800000', 'USD', ''),
+            AccountValue('DU0000000', 'BuyingPower', '2000000', 'USD', ''),
+        ]
+
+    def portfolio(self):
+        self._count('portfolio')
+        items = []
+        for symbol in self.symbols:
+            spot = self._spot[symbol]
+            stock = Stock(symbol, 'NASDAQ', 'USD')
+            stock.conId = self._con_id(stock)
+            items.append(PortfolioItem(stock, 100, spot, 100 * spot, spot, 0.0, 0.0, 'DU0000000'))
+            for right in ('C', 'P'):
+                option = Option(symbol, self.expirations[2], round(spot), right, 'AMEX',
+                                multiplier='100', currency='USD')
+                option.conId = self._con_id(option)
+                price = self._option_values(option)[0]
+                items.append(PortfolioItem(option, -2, price, -200 * price, price, 0.0, 0.0, 'DU0000000'))
+        return items
+
+    # Contracts
+    async def qualifyContractsAsync(self, *contracts):
+        self._count('qualifyContracts')
+        await self._wait()
+        for contract in contracts:
+            known = self._contracts.get(contract.conId)
+            if known is not None:
+                # Qualifying by conId alone fills in the rest, as IB does
+                for field in ('secType', 'symbol', 'lastTradeDateOrContractMonth', 'strike',
+                              'right', 'multiplier', 'currency'):
+                    setattr(contract, field, getattr(known, field))
+            else:
+                contract.conId = self._con_id(contract)
+        return list(contracts)
+
+    async def reqSecDefOptParamsAsync(self, underlyingSymbol, futFopExchange, underlyingSecType,
+                                      underlyingConId):
+        self._count('reqSecDefOptParams')
+        await self._wait()
+        spot = self._spot.get(underlyingSymbol, 100.0)
+        step = 1.0 if spot < 100 else 5.0
+        half = self.strikes_per_chain // 2
+        strikes = [round(spot / step) * step + step * i for i in range(-half, half)]
+        return [OptionChain('SMART', underlyingConId, underlyingSymbol, '100',
+                            self.expirations, strikes)]
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime, durationStr, barSizeSetting,
+                                     whatToShow, useRTH, **kwargs):
+        self._count('reqHistoricalData')
+        await self._wait()
+        return []
+
+    # Market data
+    def reqMarketDataType(self, marketDataType):
+        self._count('reqMarketDataType')
+
+    def reqMktData(self, contract, genericTickList='', snapshot=False, regulatorySnapshot=False,
+                   mktDataOptions=None):
+        self._count('reqMktData')
+        ticker = self._tickers.get(id(contract))
+        if ticker is None:
+            ticker = Ticker(contract=contract)
+            self._tickers[id(contract)] = ticker
+        self._fill(ticker)
+        return ticker
+
+    def cancelMktData(self, contract):
+        self._count('cancelMktData')
+        self._tickers.pop(id(contract), None)
+
+    def _fill(self, ticker):
+        contract = ticker.contract
+        spot = self._spot.get(contract.symbol, 100.0) * (1 + self._random.gauss(0, 0.001))
+        if contract.secType == 'OPT':
+            price, delta, gamma, vega, theta, iv = self._option_values(contract, spot)
+            ticker.modelGreeks = OptionComputation(0, iv, delta, price, 0.0, gamma, vega, theta, spot)
+        else:
+            price = spot
+        ticker.bid = round(price * 0.995, 2)
+        ticker.ask = round(price * 1.005, 2)
+        ticker.last = round(price, 2)
+        ticker.marketDataType = 1
+
+    def _option_values(self, contract, spot=None):
+        """Black-Scholes price and Greeks with a flat 30% vol and zero rates"""
+        spot = spot or self._spot.get(contract.symbol, 100.0)
+        expiry = date(int(contract.lastTradeDateOrContractMonth[:4]),
+                      int(contract.lastTradeDateOrContractMonth[4:6]),
+                      int(contract.lastTradeDateOrContractMonth[6:8]))
+        years = max((expiry - date.today()).days, 1) / 365.0
+        iv = 0.3
+        strike = contract.strike or spot
+        d1 = (math.log(spot / strike) + 0.5 * iv * iv * years) / (iv * math.sqrt(years))
+        d2 = d1 - iv * math.sqrt(years)
+        pdf = math.exp(-0.5 * d1 * d1) / math.sqrt(2 * math.pi)
+        if contract.right == 'C':
+            price = spot * _norm_cdf(d1) - strike * _norm_cdf(d2)
+            delta = _norm_cdf(d1)
+        else:
+            price = strike * _norm_cdf(-d2) - spot * _norm_cdf(-d1)
+            delta = _norm_cdf(d1) - 1
+        gamma = pdf / (spot * iv * math.sqrt(years))
+        vega = spot * pdf * math.sqrt(years) / 100
+        theta = -spot * pdf * iv / (2 * math.sqrt(years)) / 365
+        return max(price, 0.01), delta, gamma, vega, theta, iv
+
+    # Option computations used by the portfolio fallback path
+    async def calculateImpliedVolatilityAsync(self, contract, optionPrice, underPrice):
+        self._count('calculateImpliedVolatility')
+        await self._wait()
+
+    async def calculateOptionPriceAsync(self, contract, volatility, underPrice):
+        self._count('calculateOptionPrice')
+        await self._wait()
+
+    async def accountSummaryAsync(self):
+        self._count('accountSummary')
+        await self._wait()
+        return self.accountValues()
+
+    async def positionsAsync(self):
+        self._count('positions')
+        await self._wait()
+        return []
+
+    def request_counts(self):
+        with self._lock:
+            return dict(self.requests)
+
+    def request_counts_by_source(self):
+        with self._lock:
+            return {source: dict(counts) for source, counts in self.requests_by_source.items()}
+
@@ -0,0 +1,117 @@
+import threading
+
+import numpy as np
+
+# Bucket width in seconds and number of buckets kept per resolution:
+# 1s for the last hour, 1m for the last day, 5m for the last week
+RESOLUTIONS = {
+    '1s': (1, 3600),
+    '1m': (60, 1440),
+    '5m': (300, 2016),
+}
+# Per-underlying NPV columns; symbols beyond this are left out of the history
+MAX_SYMBOLS = 64
+
+FIELDS = ['nlv', 'ngav', 'nlr']
+
+
+class RingBuffer:
+    """Fixed-capacity time series in preallocated NumPy arrays
+
+    Samples that fall in the same bucket overwrite the latest row, so each row
+    holds the last valuation of its bucket. Timestamps only move forward,
+    which keeps the two contiguous halves of the ring sorted for searchsorted.
+    """
+
+    def __init__(self, bucket_seconds, capacity, columns):
+        self.bucket_seconds = bucket_seconds
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.full((capacity, columns), np.nan, dtype=np.float64)
+        self.count = 0
+        self.head = 0  # next row to write
+        self._last_bucket = None
+
+    def append(self, timestamp, row):
+        bucket = int(timestamp // self.bucket_seconds)
+        if bucket == self._last_bucket:
+            index = (self.head - 1) % self.capacity
+        else:
+            if self._last_bucket is not None and bucket < self._last_bucket:
+                return  # out-of-order sample
+            index = self.head
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self._last_bucket = bucket
+        self.times[index] = timestamp
+        self.values[index] = row
+
+    def window(self, start, end):
+        """Rows with start <= timestamp <= end in time order, as (times, values) copies"""
+        if self.count < self.capacity:
+            segments = [(0, self.count)]
+        else:
+            segments = [(self.head, self.capacity), (0, self.head)]
+
+        slices = []
+        for first, last in segments:
+            times = self.times[first:last]
+            lo = first + int(np.searchsorted(times, start, side='left'))
+            hi = first + int(np.searchsorted(times, end, side='right'))
+            if hi > lo:
+                slices.append(slice(lo, hi))
+
+        if not slices:
+            return np.empty(0), np.empty((0, self.values.shape[1]))
+        return (np.concatenate([self.times[s] for s in slices]),
+                np.concatenate([self.values[s] for s in slices]))
+
+
+class PortfolioHistory:
+    """Intraday NLV/NGAV/NLR and per-underlying NPV at several resolutions
+
+    Memory is fixed at construction: every resolution preallocates its ring
+    buffer, and underlyings get one of MAX_SYMBOLS columns the first time
+    they are seen.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS, max_symbols=MAX_SYMBOLS):
+        self.max_symbols = max_symbols
+        self.symbols = {}
+        columns = len(FIELDS) + max_symbols
+        self.buffers = {
+            name: RingBuffer(bucket_seconds, capacity, columns)
+            for name, (bucket_seconds, capacity) in resolutions.items()
+        }
+        self._lock = threading.Lock()
+
+    def record(self, timestamp, nlv, ngav, nlr, npv_by_symbol):
+        with self._lock:
+            row = np.full(len(FIELDS) + self.max_symbols, np.nan)
+            row[:len(FIELDS)] = (nlv, ngav, nlr)
+            for symbol, npv in npv_by_symbol.items():
+                column = self.symbols.get(symbol)
+                if column is None:
+                    if len(self.symbols) >= self.max_symbols:
+                        continue
+                    column = self.symbols[symbol] = len(self.symbols)
+                row[len(FIELDS) + column] = npv
+            for buffer in self.buffers.values():
+                buffer.append(timestamp, row)
+
+    def query(self, resolution, start, end):
+        """Columnar window of one resolution; raises KeyError for an unknown resolution"""
+        buffer = self.buffers[resolution]
+        with self._lock:
+            times, values = buffer.window(start, end)
+            symbols = dict(self.symbols)
+
+        def column(index):
+            return [None if np.isnan(v) else float(v) for v in values[:, index]]
+
+        return {
+            'resolution': resolution,
+            'timestamps': times.tolist(),
+            **{field: column(i) for i, field in enumerate(FIELDS)},
+            'npv': {symbol: column(len(FIELDS) + index) for symbol, index in symbols.items()},
+        }
@@ -1,7 +1,10 @@
 import pandas as pd
 import asyncio
 import locale
+import math
 import random
+import time
+from collections import Counter
 from datetime import datetime
 import traceback
 
@@ -10,6 +13,10 @@ locale.setlocale(locale.LC_ALL, '')
 
 # Import our utility functions
 from utils import safe_float_conversion
+from exposure import aggregate_exposure
+from profiling import span
+from tick_throttle import TickCoalescer
+from market_data import MarketDataPolicy, data_type_name
 
 # Import IB API after setting up asyncio environment
 try:
@@ -18,10 +25,16 @@ except ImportError:
     raise ImportError("Please install ib_insync: pip install ib_insync")
 
 class IBClient:
-    def __init__(self):
-        self.ib = IB()
+    def __init__(self, ib=None):
+        # Tests and load tests pass an offline stand-in such as fake_ib.FakeIB
+        self.ib = ib if ib is not None else IB()
         self.client_id = None
         self.connected = False
+        self.tick_coalescer = TickCoalescer(self.ib)
+        self.market_data = MarketDataPolicy(self.ib)
+        # Contracts left streaming by the last refresh of each chain, so the
+        # next refresh of that chain can cancel them first
+        self._streaming = {}
         self._setup_asyncio()
     
     def _setup_asyncio(self):
@@ -58,9 +71,11 @@ class IBClient:
             self.ib.connect(host, port, clientId=client_id, readonly=True)  # Added readonly=True
             self.connected = self.ib.isConnected()
             
-            # Request delayed market data by default
+            # Market data types are chosen per request by self.market_data
             if self.connected:
-                self.ib.reqMarketDataType(3)  # 3 = delayed data
+                self.market_data.reset()
+                self._streaming = {}
+                self.tick_coalescer.start()
             
             return self.connected
         except Exception as e:
@@ -69,6 +84,7 @@ class IBClient:
     
     def disconnect(self):
         """Disconnect from Interactive Brokers"""
+        self.tick_coalescer.stop()
         if self.ib.isConnected():
             self.ib.disconnect()
             self.connected = False
@@ -79,6 +95,15 @@ class IBClient:
         print(f"IB connection status check: {self.connected}")
         return self.connected
     
+    def _cancel_streaming(self, key):
+        """Cancel the market data lines a previous refresh of `key` left open"""
+        for contract in self._streaming.pop(key, ()):
+            self.market_data.cancel_mkt_data(contract)
+    
+    def cancel_options_data(self, ticker, expiration):
+        """Stop streaming a chain whose refreshes have stopped"""
+        self._cancel_streaming(('options', ticker, expiration))
+    
     # Portfolio data functions
     async def async_get_portfolio_data(self):
         """Get portfolio data asynchronously"""
@@ -89,8 +114,9 @@ class IBClient:
             print("Requesting account summary...")
             try:
                 # Add timeout to accountSummaryAsync
-                account_summary_task = asyncio.create_task(self.ib.accountSummaryAsync())
-                account_summary = await asyncio.wait_for(account_summary_task, timeout=5.0)
+                with span('portfolio.account_summary'):
+                    account_summary_task = asyncio.create_task(self.ib.accountSummaryAsync())
+                    account_summary = await asyncio.wait_for(account_summary_task, timeout=5.0)
                 print(f"Account summary received, length: {len(account_summary) if account_summary else 0}")
             except asyncio.TimeoutError:
                 print("Account summary request timed out after 5 seconds")
@@ -113,7 +139,8 @@ class IBClient:
             
             # Get positions
             print("Requesting positions...")
-            positions = await self.ib.positionsAsync()
+            with span('portfolio.positions'):
+                positions = await self.ib.positionsAsync()
             print(f"Positions received, length: {len(positions) if positions else 0}")
             
             if not positions:
@@ -135,11 +162,13 @@ class IBClient:
                 else:
                     # For options, get the underlying price
                     underlying_contract = Stock(underlying_symbol, 'SMART', 'USD')
-                    await self.ib.qualifyContractsAsync(underlying_contract)
+                    with span('portfolio.qualify_underlying'):
+                        await self.ib.qualifyContractsAsync(underlying_contract)
                 
                 # Use ticker to get real-time price updates
-                ticker = self.ib.reqMktData(underlying_contract)
-                await asyncio.sleep(0.2)  # Small delay to respect rate limits
+                ticker = self.market_data.req_mkt_data(underlying_contract)
+                with span('portfolio.underlying_tick_wait'):
+                    await asyncio.sleep(0.2)  # Small delay to respect rate limits
                 underlying_price = ticker.marketPrice()
                 
                 # Handle None or 0 prices
@@ -170,8 +199,9 @@ class IBClient:
                     positions_by_underlying[underlying_symbol]['stock_value'] += pos.position * underlying_price
                 elif contract.secType == 'OPT':
                     # Get option data
-                    option_ticker = self.ib.reqMktData(contract)
-                    await asyncio.sleep(0.2)  # Small delay to respect rate limits
+                    option_ticker = self.market_data.req_mkt_data(contract)
+                    with span('portfolio.option_tick_wait'):
+                        await asyncio.sleep(0.2)  # Small delay to respect rate limits
                     
                     # Calculate option delta (if available, otherwise use approximation)
                     delta = None
@@ -181,12 +211,12 @@ class IBClient:
                         delta = option_ticker.modelGreeks.delta
                     else:
                         # Request option computation
-                        await self.ib.reqMarketDataTypeAsync(4)  # Switch to delayed frozen data
                         try:
-                            await self.ib.calculateImpliedVolatilityAsync(contract, option_price, underlying_price)
-                            await asyncio.sleep(0.2)
-                            await self.ib.calculateOptionPriceAsync(contract, option_ticker.impliedVolatility, underlying_price)
-                            await asyncio.sleep(0.2)
+                            with span('portfolio.option_calculation'):
+                                await self.ib.calculateImpliedVolatilityAsync(contract, option_price, underlying_price)
+                                await asyncio.sleep(0.2)
+                                await self.ib.calculateOptionPriceAsync(contract, option_ticker.impliedVolatility, underlying_price)
+                                await asyncio.sleep(0.2)
                             
                             # Try again to get delta
                             if hasattr(option_ticker, 'modelGreeks') and option_ticker.modelGreeks:
@@ -301,15 +331,20 @@ class IBClient:
         """Get option chain for a ticker asynchronously"""
         # Get the stock contract
         stock = Stock(ticker, 'SMART', 'USD')
-        await self.ib.qualifyContractsAsync(stock)
+        with span('chain.qualify_underlying'):
+            await self.ib.qualifyContractsAsync(stock)
         
         # Get current stock price
-        ticker = self.ib.reqMktData(stock)
-        await asyncio.sleep(0.2)
+        self._cancel_streaming(('chain', ticker))
+        self._streaming[('chain', ticker)] = [stock]
+        ticker = self.market_data.req_mkt_data(stock)
+        with span('chain.underlying_tick_wait'):
+            await asyncio.sleep(0.2)
         stock_price = ticker.marketPrice()
         
         # Get the option chains
-        chains = await self.ib.reqSecDefOptParamsAsync(stock.symbol, '', stock.secType, stock.conId)
+        with span('chain.sec_def_opt_params'):
+            chains = await self.ib.reqSecDefOptParamsAsync(stock.symbol, '', stock.secType, stock.conId)
         
         # Get all expiration dates
         expirations = []
@@ -337,20 +372,29 @@ class IBClient:
         """Get options data for a specific expiration asynchronously"""
         # Get the stock contract
         stock = Stock(ticker, 'SMART', 'USD')
-        await self.ib.qualifyContractsAsync(stock)
+        with span('options.qualify_underlying'):
+            await self.ib.qualifyContractsAsync(stock)
+        
+        # Lines stay open so ticks keep the cached rows current until the next refresh
+        key = ('options', ticker, expiration)
+        self._cancel_streaming(key)
+        streaming = self._streaming[key] = []
         
         # Get current stock price
-        ticker_data = self.ib.reqMktData(stock)
-        await asyncio.sleep(0.2)
+        ticker_data = self.market_data.req_mkt_data(stock)
+        streaming.append(stock)
+        with span('options.underlying_tick_wait'):
+            await asyncio.sleep(0.2)
         stock_price = ticker_data.marketPrice()
         
         # Get option chain for selected expiration
-        chains = await self.ib.reqSecDefOptParamsAsync(stock.symbol, '', stock.secType, stock.conId)
+        with span('options.sec_def_opt_params'):
+            chains = await self.ib.reqSecDefOptParamsAsync(stock.symbol, '', stock.secType, stock.conId)
         
         # Find the SMART exchange chain
         chain = next((c for c in chains if c.exchange == 'SMART'), None)
         if not chain:
-            return None, None, None
+            return None, None, None, None
         
         # Get all strike prices
         strikes = sorted(chain.strikes)
@@ -364,92 +408,281 @@ class IBClient:
             call_contract = Option(ticker, expiration, strike, 'C', 'SMART')
             put_contract = Option(ticker, expiration, strike, 'P', 'SMART')
             
-            await self.ib.qualifyContractsAsync(call_contract, put_contract)
+            with span('options.qualify_strike'):
+                await self.ib.qualifyContractsAsync(call_contract, put_contract)
             
             # Request market data for call
-            call_ticker = self.ib.reqMktData(call_contract)
-            await asyncio.sleep(0.1)  # Small delay to respect rate limits
+            call_ticker = self.market_data.req_mkt_data(call_contract)
+            streaming.append(call_contract)
+            with span('options.fixed_sleep'):
+                await asyncio.sleep(0.1)  # Small delay to respect rate limits
             
             # Request market data for put
-            put_ticker = self.ib.reqMktData(put_contract)
-            await asyncio.sleep(0.1)  # Small delay
-            
-            # Get data for call
-            call_price = call_ticker.marketPrice()
-            call_bid = call_ticker.bid
-            call_ask = call_ticker.ask
-            call_last = call_ticker.last
-            
-            # Try to get delta and gamma for call
-            call_delta = None
-            call_gamma = None
-            
-            if hasattr(call_ticker, 'modelGreeks') and call_ticker.modelGreeks:
-                call_delta = call_ticker.modelGreeks.delta
-                call_gamma = call_ticker.modelGreeks.gamma
-            else:
-                # Use approximation
-                call_delta = 0.7 if stock_price > strike else 0.3
-                call_gamma = 0.01  # Default gamma
+            put_ticker = self.market_data.req_mkt_data(put_contract)
+            streaming.append(put_contract)
+            with span('options.fixed_sleep'):
+                await asyncio.sleep(0.1)  # Small delay
             
-            # Similarly for put
-            put_price = put_ticker.marketPrice()
-            put_bid = put_ticker.bid
-            put_ask = put_ticker.ask
-            put_last = put_ticker.last
-            
-            put_delta = None
-            put_gamma = None
-            
-            if hasattr(put_ticker, 'modelGreeks') and put_ticker.modelGreeks:
-                put_delta = put_ticker.modelGreeks.delta
-                put_gamma = put_ticker.modelGreeks.gamma
-            else:
-                # Use approximation
-                put_delta = -0.7 if stock_price < strike else -0.3
-                put_gamma = 0.01  # Default gamma
-            
-            # Calculate percentage of stock price
-            call_pct = (call_price / stock_price) * 100 if stock_price > 0 else 0
-            put_pct = (put_price / stock_price) * 100 if stock_price > 0 else 0
-            
-            # Calculate difference from stock price
-            call_diff = call_price - (stock_price - strike) if stock_price > strike else call_price
-            put_diff = put_price - (strike - stock_price) if stock_price < strike else put_price
-            
-            calls.append({
-                'Strike': strike,
-                'Bid': call_bid,
-                'Ask': call_ask,
-                'Last': call_last,
-                'Price': call_price,
-                'Delta': call_delta,
-                'Gamma': call_gamma,
-                'Pct of Stock': call_pct,
-                'Diff from Stock': call_diff
-            })
-            
-            puts.append({
-                'Strike': strike,
-                'Bid': put_bid,
-                'Ask': put_ask,
-                'Last': put_last,
-                'Price': put_price,
-                'Delta': put_delta,
-                'Gamma': put_gamma,
-                'Pct of Stock': put_pct,
-                'Diff from Stock': put_diff
-            })
+            calls.append(self.option_row(call_ticker, stock_price))
+            puts.append(self.option_row(put_ticker, stock_price))
         
-        return stock_price, calls, puts
+        return stock_price, calls, puts, data_type_name(ticker_data.marketDataType)
+    
+    def option_row(self, option_ticker, stock_price):
+        """Build one options table row from an option ticker and the underlying price"""
+        contract = option_ticker.contract
+        strike = contract.strike
+        price = option_ticker.marketPrice()
+        
+        # Try to get delta and gamma, otherwise use approximation
+        if hasattr(option_ticker, 'modelGreeks') and option_ticker.modelGreeks:
+            delta = option_ticker.modelGreeks.delta
+            gamma = option_ticker.modelGreeks.gamma
+        elif contract.right == 'C':
+            delta = 0.7 if stock_price > strike else 0.3
+            gamma = 0.01  # Default gamma
+        else:
+            delta = -0.7 if stock_price < strike else -0.3
+            gamma = 0.01  # Default gamma
+        
+        # Calculate percentage of stock price
+        pct = (price / stock_price) * 100 if stock_price > 0 else 0
+        
+        # Calculate difference from stock price
+        if contract.right == 'C':
+            diff = price - (stock_price - strike) if stock_price > strike else price
+        else:
+            diff = price - (strike - stock_price) if stock_price < strike else price
+        
+        return {
+            'conId': contract.conId,
+            'Strike': strike,
+            'Bid': option_ticker.bid,
+            'Ask': option_ticker.ask,
+            'Last': option_ticker.last,
+            'Price': price,
+            'Delta': delta,
+            'Gamma': gamma,
+            'Pct of Stock': pct,
+            'Diff from Stock': diff,
+            'Data Type': data_type_name(option_ticker.marketDataType)
+        }
     
     def get_options_for_expiration(self, ticker, expiration):
         """Get options data for specific expiration (non-async wrapper)"""
         if not self.ib.isConnected():
-            return None, None, None
+            return None, None, None, None
         
         try:
             return self._run_async(self.async_get_options_for_expiration(ticker, expiration))
         except Exception as e:
             print(f"Error getting options data: {e}")
-            return None, None, None
\ No newline at end of file
+            return None, None, None, None
+    
+    # Batched market data snapshots
+    def _ticker_ready(self, ticker):
+        """Check whether a ticker has received the data a snapshot needs"""
+        if ticker.contract.secType == 'OPT':
+            return ticker.modelGreeks is not None
+        price = ticker.marketPrice()
+        return price is not None and not math.isnan(price)
+    
+    async def _async_snapshot_tickers(self, contracts, timeout=2.0, line_budget=None):
+        """Subscribe to all contracts at once, wait for their first ticks, then unsubscribe
+        
+        `line_budget` optionally bounds how many market data lines are open at once
+        across concurrent snapshots (see scanner.LineBudget).
+        """
+        if line_budget is not None:
+            await line_budget.acquire(len(contracts))
+        try:
+            tickers = [self.market_data.req_mkt_data(contract) for contract in contracts]
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if all(self._ticker_ready(t) for t in tickers):
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            for contract in contracts:
+                self.market_data.cancel_mkt_data(contract)
+            if line_budget is not None:
+                await line_budget.release(len(contracts))
+        return tickers
+    
+    async def async_get_chain_snapshot(self, ticker, min_dte=0, strike_count=10, line_budget=None):
+        """Snapshot the strikes nearest spot for the first expiration at least `min_dte` days out
+        
+        Returns a dict with the qualified stock, its price, the expiration and the
+        option tickers, or None if the ticker has no usable chain.
+        """
+        stock = Stock(ticker, 'SMART', 'USD')
+        with span('scan.qualify_underlying'):
+            await self.ib.qualifyContractsAsync(stock)
+        if not stock.conId:
+            return None
+        
+        stock_ticker, = await self._async_snapshot_tickers([stock], line_budget=line_budget)
+        stock_price = stock_ticker.marketPrice()
+        if stock_price is None or math.isnan(stock_price) or stock_price <= 0:
+            return None
+        
+        with span('scan.sec_def_opt_params'):
+            chains = await self.ib.reqSecDefOptParamsAsync(stock.symbol, '', stock.secType, stock.conId)
+        chain = next((c for c in chains if c.exchange == 'SMART'), None)
+        if not chain:
+            return None
+        
+        today = datetime.now().date()
+        expirations = [
+            exp for exp in sorted(chain.expirations)
+            if (datetime.strptime(exp, '%Y%m%d').date() - today).days >= min_dte
+        ]
+        if not expirations:
+            return None
+        expiration = expirations[0]
+        
+        # Only the strikes closest to spot are relevant for a scan
+        strikes = sorted(sorted(chain.strikes, key=lambda k: abs(k - stock_price))[:strike_count])
+        contracts = [
+            Option(ticker, expiration, strike, right, 'SMART')
+            for strike in strikes for right in ('C', 'P')
+        ]
+        with span('scan.qualify_options'):
+            await self.ib.qualifyContractsAsync(*contracts)
+        # chain.strikes spans all expirations, so some strikes don't exist for this one
+        contracts = [c for c in contracts if c.conId]
+        
+        with span('scan.tick_wait'):
+            tickers = await self._async_snapshot_tickers(contracts, line_budget=line_budget)
+        
+        return {
+            'stock': stock,
+            'stock_price': stock_price,
+            'stock_data_type': data_type_name(stock_ticker.marketDataType),
+            'expiration': expiration,
+            'tickers': tickers,
+        }
+    
+    async def _async_quote_portfolio_options(self, items):
+        """Snapshot option portfolio items and their underlyings in one batch
+        
+        Returns the option tickers in item order and the stock tickers by symbol.
+        """
+        # Portfolio contracts carry the listing exchange; route quotes through SMART
+        options = [Option(conId=item.contract.conId, exchange='SMART') for item in items]
+        symbols = sorted({item.contract.symbol for item in items})
+        stocks = [Stock(symbol, 'SMART', 'USD') for symbol in symbols]
+        with span('portfolio_options.qualify'):
+            await self.ib.qualifyContractsAsync(*options, *stocks)
+        
+        with span('portfolio_options.tick_wait'):
+            tickers = await self._async_snapshot_tickers(options + stocks)
+        return tickers[:len(options)], dict(zip(symbols, tickers[len(options):]))
+    
+    @staticmethod
+    def _underlying_price(stock_ticker, option_ticker):
+        price = stock_ticker.marketPrice() if stock_ticker is not None else None
+        greeks = option_ticker.modelGreeks
+        if (price is None or math.isnan(price) or price <= 0) and greeks and greeks.undPrice:
+            price = greeks.undPrice
+        return price
+    
+    async def async_get_option_deltas(self, items):
+        """Delta, underlying price and quote data types for option portfolio items, keyed by conId
+        
+        Falls back to the same rough delta as async_get_portfolio_data when IB
+        has no model Greeks for a contract.
+        """
+        if not items:
+            return {}
+        option_tickers, stock_tickers = await self._async_quote_portfolio_options(items)
+        
+        deltas = {}
+        for item, ticker in zip(items, option_tickers):
+            contract = item.contract
+            spot = self._underlying_price(stock_tickers.get(contract.symbol), ticker)
+            greeks = ticker.modelGreeks
+            delta = greeks.delta if greeks and greeks.delta is not None else None
+            if delta is None and spot:
+                if contract.right == 'C':
+                    delta = 0.7 if spot > contract.strike else 0.3
+                else:
+                    delta = -0.7 if spot < contract.strike else -0.3
+            stock_ticker = stock_tickers.get(contract.symbol)
+            deltas[contract.conId] = {
+                'delta': delta,
+                'underlying_price': spot,
+                'data_type': data_type_name(ticker.marketDataType),
+                'underlying_data_type': data_type_name(stock_ticker.marketDataType) if stock_ticker else None,
+            }
+        return deltas
+    
+    def get_option_deltas(self, items):
+        """Delta and underlying price for option portfolio items (non-async wrapper)"""
+        if not self.ib.isConnected():
+            return {}
+        
+        try:
+            return self._run_async(self.async_get_option_deltas(items))
+        except Exception as e:
+            print(f"Error getting option deltas: {e}")
+            print(traceback.format_exc())
+            return {}
+    
+    # Portfolio-wide option exposure
+    async def async_get_portfolio_exposure(self):
+        """Get Greek exposures for every option position in one batched pass"""
+        items = [item for item in self.ib.portfolio() if item.contract.secType == 'OPT']
+        if not items:
+            return {**aggregate_exposure([]), 'data_types': {}, 'position_data_types': []}
+        
+        option_tickers, stock_tickers = await self._async_quote_portfolio_options(items)
+        tickers = option_tickers + list(stock_tickers.values())
+        stock_data_types = {
+            symbol: data_type_name(ticker.marketDataType)
+            for symbol, ticker in stock_tickers.items()
+        }
+        
+        nan = float('nan')
+        positions = []
+        for item, ticker in zip(items, option_tickers):
+            greeks = ticker.modelGreeks
+            spot = self._underlying_price(stock_tickers.get(item.contract.symbol), ticker)
+            positions.append({
+                'Symbol': item.contract.symbol,
+                'Expiry': item.contract.lastTradeDateOrContractMonth,
+                'Position': item.position,
+                'Multiplier': safe_float_conversion(item.contract.multiplier) or 100,
+                'Underlying Price': spot if spot is not None else nan,
+                'Delta': greeks.delta if greeks and greeks.delta is not None else nan,
+                'Gamma': greeks.gamma if greeks and greeks.gamma is not None else nan,
+                'Vega': greeks.vega if greeks and greeks.vega is not None else nan,
+                'Theta': greeks.theta if greeks and greeks.theta is not None else nan,
+                'Local Symbol': item.contract.localSymbol,
+                'Strike': item.contract.strike,
+                'Right': item.contract.right,
+                'Data Type': data_type_name(ticker.marketDataType),
+                'Underlying Data Type': stock_data_types.get(item.contract.symbol),
+            })
+        
+        exposure = aggregate_exposure(positions)
+        exposure['data_types'] = dict(Counter(data_type_name(t.marketDataType) for t in tickers))
+        # Which quotes behind the totals are delayed or frozen, position by position
+        exposure['position_data_types'] = [
+            {key: p[key] for key in ('Symbol', 'Local Symbol', 'Expiry', 'Strike', 'Right',
+                                     'Position', 'Data Type', 'Underlying Data Type')}
+            for p in positions
+        ]
+        return exposure
+    
+    def get_portfolio_exposure(self):
+        """Get portfolio-wide option exposure (non-async wrapper)"""
+        if not self.ib.isConnected():
+            return None
+        
+        try:
+            return self._run_async(self.async_get_portfolio_exposure())
+        except Exception as e:
+            print(f"Error getting portfolio exposure: {e}")
+            print(traceback.format_exc())
+            return None
@@ -0,0 +1,239 @@
+"""Concurrent-client load test for the Flask API against the offline FakeIB backend
+
+Simulates N browser sessions, each polling /api/status, /api/portfolio and
+/api/exposure and keeping M option chain tabs open on /api/options, the way
+the React frontend does. Reports p50/p99 latency and throughput per
+endpoint, server thread count and IB request volume per endpoint and
+refresh job.
+
+    python loadtest.py --clients 20 --tabs 3 --duration 60
+    python loadtest.py --clients 50 --tabs 2 --json results.json
+
+The server runs in this process (werkzeug, threaded) so the thread count and
+IB request counters can be read directly. Client and server share the GIL,
+so absolute latencies are pessimistic; compare runs against each other.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# Keep the snapshot database of a load test away from the real one
+os.environ.setdefault('IB_SNAPSHOT_PATH', os.path.join(tempfile.mkdtemp(), 'snapshots.db'))
+
+from werkzeug.serving import make_server
+
+import app as backend
+from flask import g, request
+from fake_ib import FakeIB
+from ib_client import IBClient
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.thread_samples = []
+
+    def record(self, endpoint, status, elapsed):
+        self.latencies[endpoint].append(elapsed)
+        self.statuses[endpoint][status] += 1
+
+
+async def http_get(host, port, path):
+    """Minimal HTTP/1.1 GET over asyncio streams; returns the status code"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def sleep_until(delay, deadline):
+    """Sleep `delay` seconds, but never past the deadline"""
+    await asyncio.sleep(max(min(delay, deadline - time.monotonic()), 0))
+
+
+async def poll(stats, host, port, endpoint, path, interval, deadline):
+    # Spread clients out instead of having them all fire on the same tick
+    await sleep_until(random.uniform(0, interval), deadline)
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            status = await http_get(host, port, path)
+        except (OSError, ValueError, IndexError):
+            status = 'failed'
+        stats.record(endpoint, status, time.perf_counter() - started)
+        await sleep_until(interval, deadline)
+
+
+async def sample_threads(stats, deadline):
+    while time.monotonic() < deadline:
+        stats.thread_samples.append(threading.active_count())
+        await sleep_until(0.5, deadline)
+
+
+async def run_clients(args, host, port, symbols, expirations):
+    stats = Stats()
+    deadline = time.monotonic() + args.duration
+    tasks = [sample_threads(stats, deadline)]
+    for _ in range(args.clients):
+        tasks.append(poll(stats, host, port, 'status', '/api/status', args.status_interval, deadline))
+        tasks.append(poll(stats, host, port, 'portfolio', '/api/portfolio',
+                          args.portfolio_interval, deadline))
+        if args.exposure_interval > 0:
+            tasks.append(poll(stats, host, port, 'exposure', '/api/exposure',
+                              args.exposure_interval, deadline))
+        for _ in range(args.tabs):
+            ticker = random.choice(symbols)
+            expiration = random.choice(expirations)
+            path = f"/api/options?ticker={ticker}&expiration={expiration}"
+            tasks.append(poll(stats, host, port, 'options', path, args.options_interval, deadline))
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def attribute_ib_requests():
+    """Tag FakeIB requests with the endpoint or refresh job that made them"""
+    @backend.app.before_request
+    def enter_source():
+        g.ib_source = FakeIB.source(f'endpoint:{request.endpoint}')
+        g.ib_source.__enter__()
+
+    @backend.app.teardown_request
+    def exit_source(exc):
+        source = g.pop('ib_source', None)
+        if source is not None:
+            source.__exit__(None, None, None)
+
+    # Refresh jobs look these up at call time, so wrapping the module globals
+    # before /api/connect covers every job the scheduler registers
+    update_portfolio_data = backend.update_portfolio_data
+    update_options_data = backend.update_options_data
+
+    def traced_portfolio():
+        with FakeIB.source('job:portfolio'):
+            return update_portfolio_data()
+
+    def traced_options(ticker, expiration):
+        with FakeIB.source('job:options'):
+            return update_options_data(ticker, expiration)
+
+    backend.update_portfolio_data = traced_portfolio
+    backend.update_options_data = traced_options
+
+
+def summarize(stats, ib_requests, ib_requests_by_source, duration):
+    endpoints = {}
+    for endpoint, latencies in sorted(stats.latencies.items()):
+        values = np.array(latencies) * 1000
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'throughput_rps': round(len(values) / duration, 2),
+            'p50_ms': round(float(np.percentile(values, 50)), 2),
+            'p99_ms': round(float(np.percentile(values, 99)), 2),
+            'max_ms': round(float(values.max()), 2),
+            'statuses': {str(status): count for status, count in stats.statuses[endpoint].items()},
+        }
+    threads = np.array(stats.thread_samples or [threading.active_count()])
+    return {
+        'endpoints': endpoints,
+        'threads': {'mean': round(float(threads.mean()), 1), 'max': int(threads.max())},
+        'ib_requests': ib_requests,
+        'ib_requests_per_second': round(sum(ib_requests.values()) / duration, 2),
+        'ib_requests_by_source': {
+            source: {
+                'requests': sum(counts.values()),
+                'per_second': round(sum(counts.values()) / duration, 2),
+                'methods': counts,
+            }
+            for source, counts in sorted(ib_requests_by_source.items())
+        },
+    }
+
+
+def print_report(report, args):
+    print(f"\n{args.clients} clients x {args.tabs} chain tabs for {args.duration}s")
+    print(f"{'endpoint':<12}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<12}{row['requests']:>10}{row['throughput_rps']:>10}{row['p50_ms']:>10}"
+              f"{row['p99_ms']:>10}{row['max_ms']:>10}  {row['statuses']}")
+    print(f"\nserver threads: mean {report['threads']['mean']}, max {report['threads']['max']}")
+    print(f"IB requests: {report['ib_requests_per_second']}/s")
+    for method, count in sorted(report['ib_requests'].items(), key=lambda item: -item[1]):
+        print(f"  {method:<28}{count:>8}")
+    print("IB requests by source:")
+    for source, row in report['ib_requests_by_source'].items():
+        methods = ', '.join(f"{method} {count}" for method, count in
+                            sorted(row['methods'].items(), key=lambda item: -item[1]))
+        print(f"  {source:<28}{row['requests']:>8}{row['per_second']:>10}/s  {methods}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clients', type=int, default=10, help='simulated browser sessions')
+    parser.add_argument('--tabs', type=int, default=2, help='option chain tabs per session')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--status-interval', type=float, default=5)
+    parser.add_argument('--portfolio-interval', type=float, default=15)
+    parser.add_argument('--options-interval', type=float, default=5)
+    parser.add_argument('--exposure-interval', type=float, default=30,
+                        help='seconds between /api/exposure polls per session, 0 to skip')
+    parser.add_argument('--strikes', type=int, default=20, help='strikes per fake option chain')
+    parser.add_argument('--ib-latency', type=float, default=0.0, help='simulated IB round trip (s)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--verbose', action='store_true', help="keep the backend's console output")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    fake_ib = FakeIB(strikes_per_chain=args.strikes, latency=args.ib_latency, seed=args.seed)
+    backend.ib_client = IBClient(ib=fake_ib)
+    backend.ib_client.tick_coalescer.add_listener(backend.apply_tick_updates)
+    attribute_ib_requests()
+
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, name='loadtest_server')
+    server_thread.daemon = True
+    server_thread.start()
+    host, port = '127.0.0.1', server.server_port
+
+    # The backend logs every request; keep that out of the report unless asked
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    try:
+        with backend.app.test_client() as client:
+            client.post('/api/connect', json={'host': '127.0.0.1', 'port': 7497, 'client_id': 1})
+        started = time.monotonic()
+        stats = asyncio.run(run_clients(args, host, port, fake_ib.symbols, fake_ib.expirations))
+        elapsed = time.monotonic() - started
+    finally:
+        if not args.verbose:
+            sys.stdout.close()
+            sys.stdout = stdout
+        server.shutdown()
+
+    report = summarize(stats, fake_ib.request_counts(), fake_ib.request_counts_by_source(), elapsed)
+    print_report(report, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
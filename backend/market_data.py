@@ -0,0 +1,106 @@
+import os
+import threading
+
+from scheduler import market_session
+
+# IB market data types
+LIVE = 1
+FROZEN = 2
+DELAYED = 3
+DELAYED_FROZEN = 4
+
+DATA_TYPE_NAMES = {
+    LIVE: 'live',
+    FROZEN: 'frozen',
+    DELAYED: 'delayed',
+    DELAYED_FROZEN: 'delayed-frozen',
+}
+
+# 354: not subscribed; 10167: not subscribed, displaying delayed data instead
+NO_SUBSCRIPTION_ERRORS = {354, 10167}
+
+# Set IB_MARKET_DATA_TYPE=delayed for accounts without any live subscriptions
+DEFAULT_DATA_TYPE = DELAYED if os.environ.get('IB_MARKET_DATA_TYPE') == 'delayed' else LIVE
+
+
+def data_type_name(data_type):
+    return DATA_TYPE_NAMES.get(data_type, 'unknown')
+
+
+class MarketDataPolicy:
+    """Chooses the market data type for each reqMktData instead of one global setting
+
+    IB applies reqMarketDataType to every subsequent reqMktData on the
+    connection, so the type is switched right before each request (only when
+    it differs from the last one sent). Contracts are requested live by
+    default; a contract that comes back with a no-subscription error is
+    re-requested delayed and remembered. Outside the hours a contract trades
+    (the regular session for options, extended hours too for stocks)
+    requests ask for the frozen variant so they still get the last quote.
+    """
+
+    def __init__(self, ib, session_func=market_session):
+        self.ib = ib
+        self.session_func = session_func
+        self.fallbacks = 0
+        self._delayed_con_ids = set()
+        self._current_type = None
+        self._active = {}
+        self._lock = threading.RLock()
+        self.ib.errorEvent += self._on_error
+
+    def reset(self):
+        """Forget the type last sent; a new connection starts from the TWS default"""
+        with self._lock:
+            self._current_type = None
+            self._active = {}
+
+    def data_type_for(self, contract):
+        if contract.conId in self._delayed_con_ids:
+            data_type = DELAYED
+        else:
+            data_type = DEFAULT_DATA_TYPE
+        # Options only trade in the regular session; stocks also trade extended hours
+        session = self.session_func()
+        if session == 'closed' or (session != 'regular' and contract.secType == 'OPT'):
+            data_type = FROZEN if data_type == LIVE else DELAYED_FROZEN
+        return data_type
+
+    def req_mkt_data(self, contract, *args, **kwargs):
+        """reqMktData with this contract's data type selected first"""
+        with self._lock:
+            self._set_type(self.data_type_for(contract))
+            ticker = self.ib.reqMktData(contract, *args, **kwargs)
+            # Keyed like ib_insync's tickers: two contract objects with the same
+            # conId are separate subscriptions
+            self._active[id(contract)] = (args, kwargs)
+            return ticker
+
+    def cancel_mkt_data(self, contract):
+        with self._lock:
+            self._active.pop(id(contract), None)
+            self.ib.cancelMktData(contract)
+
+    def _set_type(self, data_type):
+        if data_type != self._current_type:
+            self.ib.reqMarketDataType(data_type)
+            self._current_type = data_type
+
+    def _on_error(self, req_id, error_code, error_string, contract):
+        if error_code not in NO_SUBSCRIPTION_ERRORS or contract is None or not contract.conId:
+            return
+        with self._lock:
+            # Subscriptions are per exchange and product, so only this contract falls back
+            if contract.conId not in self._delayed_con_ids:
+                self._delayed_con_ids.add(contract.conId)
+                self.fallbacks += 1
+
+            # 10167 already streams delayed data; 354 delivers nothing, so retry delayed.
+            # ib_insync reports the error with the contract object that was requested.
+            active = self._active.get(id(contract))
+            if error_code == 354 and active is not None:
+                args, kwargs = active
+                print(f"No live subscription for {contract.localSymbol or contract.symbol}, "
+                      f"requesting delayed data")
+                self.ib.cancelMktData(contract)
+                self.req_mkt_data(contract, *args, **kwargs)
@@ -0,0 +1,160 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# Log every span slower than IB_TRACE_SLOW_MS when IB_TRACE=1
+TRACING_ENABLED = os.environ.get('IB_TRACE') == '1'
+SLOW_SPAN_SECONDS = float(os.environ.get('IB_TRACE_SLOW_MS', 500)) / 1000.0
+PROFILE_DIR = os.environ.get('IB_PROFILE_DIR', 'profiles')
+
+_local = threading.local()
+_noop_span = contextlib.nullcontext()
+
+# Latest stage breakdown of each background job, keyed by job name
+last_profiles = {}
+
+
+class StageRecorder:
+    """Accumulates total time and call count per stage name"""
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def add(self, name, elapsed):
+        total, count = self.stages.get(name, (0.0, 0))
+        self.stages[name] = (total + elapsed, count + 1)
+
+    def breakdown(self):
+        stages = sorted(self.stages.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'stages': [
+                {'stage': name, 'total_ms': round(total * 1000, 3), 'count': count}
+                for name, (total, count) in stages
+            ],
+        }
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        for recorder in getattr(_local, 'recorders', ()):
+            recorder.add(self.name, elapsed)
+        if TRACING_ENABLED and elapsed >= SLOW_SPAN_SECONDS:
+            print(f"[trace] slow stage {self.name}: {elapsed * 1000:.1f} ms")
+        return False
+
+
+def span(name):
+    """Time a stage; a shared no-op unless tracing is on or a recorder is active"""
+    if not TRACING_ENABLED and not getattr(_local, 'recorders', None):
+        return _noop_span
+    return _Span(name)
+
+
+def start_recording():
+    """Start collecting stage timings on the current thread"""
+    recorder = StageRecorder()
+    if not hasattr(_local, 'recorders'):
+        _local.recorders = []
+    _local.recorders.append(recorder)
+    return recorder
+
+
+def stop_recording(recorder):
+    """Stop collecting into `recorder` and return its breakdown"""
+    recorders = getattr(_local, 'recorders', [])
+    if recorder in recorders:
+        recorders.remove(recorder)
+    return recorder.breakdown()
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval and writes collapsed stacks
+
+    The output file has one `frame;frame;frame count` line per distinct stack,
+    which flamegraph.pl, speedscope and inferno read directly. Nothing runs
+    while the profiler is stopped.
+    """
+
+    def __init__(self, output_dir=PROFILE_DIR):
+        self.output_dir = output_dir
+        self.interval = 0.01
+        self.samples = Counter()
+        self.started_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms=10):
+        with self._lock:
+            if self.is_running():
+                return False
+            self.interval = max(interval_ms, 1) / 1000.0
+            self.samples = Counter()
+            self.started_at = datetime.now()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling_profiler')
+            self._thread.daemon = True
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling and write the collapsed stacks; returns the output path"""
+        with self._lock:
+            if not self.is_running():
+                return None
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            return self._write()
+
+    def status(self):
+        return {
+            'running': self.is_running(),
+            'interval_ms': self.interval * 1000,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'samples': sum(self.samples.values()),
+        }
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def _write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        filename = f"profile_{self.started_at.strftime('%Y%m%d_%H%M%S')}.folded"
+        path = os.path.join(self.output_dir, filename)
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
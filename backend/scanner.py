@@ -0,0 +1,310 @@
+import ast
+import asyncio
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# IB's default allowance of simultaneous market data lines
+MAX_MARKET_DATA_LINES = int(os.environ.get('IB_MAX_MARKET_DATA_LINES', 100))
+# Symbols allowed to be somewhere in their chain fetch at once
+MAX_SYMBOLS_IN_FLIGHT = 20
+# IB allows 60 historical data requests per 10 minutes
+HISTORICAL_REQUEST_LIMIT = 60
+HISTORICAL_REQUEST_WINDOW = 600.0
+
+SCAN_COLUMNS = [
+    'symbol', 'stock_price', 'data_type', 'expiration', 'dte', 'atm_iv', 'iv_rank', 'put_call_skew',
+    'best_call_strike', 'best_call_delta_per_dollar',
+    'best_put_strike', 'best_put_delta_per_dollar',
+]
+
+# Representative rows for dry-running filters: one fully populated, one with
+# the gaps real chains have (no IV rank, no Greeks, unknown data type)
+_FILTER_SAMPLE = pd.DataFrame([
+    {'symbol': 'AAPL', 'stock_price': 100.0, 'data_type': 'live', 'expiration': '20250117',
+     'dte': 30, 'atm_iv': 0.3, 'iv_rank': 50.0, 'put_call_skew': 0.02,
+     'best_call_strike': 105.0, 'best_call_delta_per_dollar': 0.1,
+     'best_put_strike': 95.0, 'best_put_delta_per_dollar': 0.1},
+    {'symbol': 'MSFT', 'stock_price': 100.0, 'data_type': None, 'expiration': '20250117',
+     'dte': 30, 'atm_iv': np.nan, 'iv_rank': np.nan, 'put_call_skew': np.nan,
+     'best_call_strike': np.nan, 'best_call_delta_per_dollar': np.nan,
+     'best_put_strike': np.nan, 'best_put_delta_per_dollar': np.nan},
+], columns=SCAN_COLUMNS)
+
+_ALLOWED_FILTER_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Eq, ast.NotEq,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Name, ast.Load, ast.Constant,
+)
+
+
+def validate_filter(expression):
+    """Reject anything but arithmetic/boolean comparisons over scan columns"""
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid filter expression: {e.msg}")
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_FILTER_NODES):
+            raise ValueError(f"Unsupported syntax in filter: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in SCAN_COLUMNS:
+            raise ValueError(f"Unknown filter column '{node.id}'")
+
+    # Type errors and non-boolean filters only show up when evaluated
+    try:
+        result = _FILTER_SAMPLE.eval(expression)
+    except Exception as e:
+        raise ValueError(f"Invalid filter expression: {e}")
+    if not isinstance(result, pd.Series) or not pd.api.types.is_bool_dtype(result):
+        raise ValueError("Filter must be a comparison that is true or false for each row")
+    return expression
+
+
+class LineBudget:
+    """Caps the number of market data lines open across concurrent snapshots"""
+
+    def __init__(self, lines):
+        self.total = lines
+        self.available = lines
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, lines):
+        # Waiting could never succeed; callers must size requests to the budget
+        if lines > self.total:
+            raise ValueError(f"Snapshot needs {lines} market data lines, budget is {self.total}")
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.available >= lines)
+            self.available -= lines
+
+    async def release(self, lines):
+        async with self._cond:
+            self.available += lines
+            self._cond.notify_all()
+
+
+class RequestPacer:
+    """Sliding-window rate limit: at most `limit` requests in any `window` seconds
+
+    Requests go out immediately until the window is full, then each waits for
+    the oldest one to age out.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._sent = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while len(self._sent) >= self.limit:
+                wait = self._sent[0] + self.window - time.monotonic()
+                if wait <= 0:
+                    self._sent.popleft()
+                else:
+                    await asyncio.sleep(wait)
+            self._sent.append(time.monotonic())
+
+
+def summarize_chain(symbol, snapshot, iv_rank=None):
+    """Reduce one chain snapshot to a single row of scan metrics"""
+    stock_price = snapshot['stock_price']
+    tickers = snapshot['tickers']
+    nan = float('nan')
+
+    strikes = np.array([t.contract.strike for t in tickers], dtype=float)
+    is_call = np.array([t.contract.right == 'C' for t in tickers])
+    prices = np.array([t.marketPrice() for t in tickers], dtype=float)
+    greeks = [t.modelGreeks for t in tickers]
+    deltas = np.array([g.delta if g and g.delta is not None else nan for g in greeks], dtype=float)
+    ivs = np.array([g.impliedVol if g and g.impliedVol is not None else nan for g in greeks], dtype=float)
+
+    def nearest(mask, values, target):
+        distance = np.where(mask & ~np.isnan(values), np.abs(values - target), np.inf)
+        return int(np.argmin(distance)) if np.isfinite(distance).any() else None
+
+    def pick(index, values):
+        return float(values[index]) if index is not None else nan
+
+    # ATM IV averages the call and put at the strike closest to spot
+    atm_call = nearest(is_call, strikes, stock_price)
+    atm_put = nearest(~is_call, strikes, stock_price)
+    atm_iv = float(np.nanmean([pick(atm_call, ivs), pick(atm_put, ivs)])) \
+        if atm_call is not None or atm_put is not None else nan
+
+    # Skew is the 25-delta put IV over the 25-delta call IV, within the fetched strikes
+    skew = pick(nearest(~is_call, deltas, -0.25), ivs) - pick(nearest(is_call, deltas, 0.25), ivs)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_per_dollar = np.where(prices > 0, np.abs(deltas) / prices, nan)
+
+    def best(mask):
+        candidates = np.where(mask & ~np.isnan(delta_per_dollar), delta_per_dollar, -np.inf)
+        if not np.isfinite(candidates).any():
+            return nan, nan
+        index = int(np.argmax(candidates))
+        return float(strikes[index]), float(delta_per_dollar[index])
+
+    best_call_strike, best_call_dpd = best(is_call)
+    best_put_strike, best_put_dpd = best(~is_call)
+
+    expiration = snapshot['expiration']
+    dte = (pd.Timestamp(expiration).date() - pd.Timestamp.now().date()).days
+
+    return {
+        'symbol': symbol,
+        'stock_price': stock_price,
+        'data_type': snapshot.get('stock_data_type'),
+        'expiration': expiration,
+        'dte': dte,
+        'atm_iv': atm_iv,
+        'iv_rank': iv_rank if iv_rank is not None else nan,
+        'put_call_skew': skew,
+        'best_call_strike': best_call_strike,
+        'best_call_delta_per_dollar': best_call_dpd,
+        'best_put_strike': best_put_strike,
+        'best_put_delta_per_dollar': best_put_dpd,
+    }
+
+
+class ChainScanner:
+    """Scans a watchlist of option chains on one event loop under IB's pacing limits
+
+    Chain fetches for every symbol run concurrently; a LineBudget keeps the
+    open market data lines within the account allowance and ib_insync's own
+    client throttle keeps the message rate under IB's 50/s. IV rank requests
+    are paced separately, after a symbol's chain slot is freed. Results are
+    filtered and ranked in batches as they arrive.
+    """
+
+    def __init__(self, ib_client, strike_count=10, min_dte=20, with_iv_rank=False,
+                 max_lines=MAX_MARKET_DATA_LINES):
+        if strike_count < 1 or min_dte < 0:
+            raise ValueError("strike_count must be at least 1 and min_dte not negative")
+        self.ib_client = ib_client
+        # Each strike takes a call and a put line; one chain must fit the budget
+        self.strike_count = min(strike_count, max_lines // 2)
+        self.min_dte = min_dte
+        self.with_iv_rank = with_iv_rank
+        self.max_lines = max_lines
+
+    def scan(self, symbols, filter_expr=None, rank_by=None, ascending=False):
+        """Yield scan events: 'result' batches as chains complete, then one 'done'
+
+        The filter is validated before any IB request is made and raises
+        ValueError if it is not allowed.
+        """
+        if filter_expr:
+            validate_filter(filter_expr)
+        if rank_by and rank_by not in SCAN_COLUMNS:
+            raise ValueError(f"Unknown rank column '{rank_by}'")
+        return self._stream(symbols, filter_expr, rank_by, ascending)
+
+    def _stream(self, symbols, filter_expr, rank_by, ascending):
+        events = queue.Queue()
+        cancelled = threading.Event()
+        worker = threading.Thread(target=self._run, args=(symbols, events, cancelled),
+                                  name='chain_scanner')
+        worker.daemon = True
+        worker.start()
+        try:
+            yield from self._collect(symbols, events, filter_expr, rank_by, ascending)
+        finally:
+            # Stop starting new chains once the stream ends or the client goes away
+            cancelled.set()
+
+    def _collect(self, symbols, events, filter_expr, rank_by, ascending):
+        matches = []
+        finished = False
+        while not finished:
+            batch = [events.get()]
+            while True:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows = []
+            for kind, payload in batch:
+                if kind == 'result':
+                    rows.append(payload)
+                elif kind == 'error':
+                    yield {'type': 'error', **payload}
+                elif kind == 'done':
+                    finished = True
+
+            if rows:
+                frame = pd.DataFrame(rows, columns=SCAN_COLUMNS)
+                if filter_expr:
+                    try:
+                        frame = frame.query(filter_expr)
+                    except Exception as e:
+                        yield {'type': 'error', 'message': f"Filter failed: {e}"}
+                        break
+                if not frame.empty:
+                    matches.append(frame)
+                    yield {'type': 'result', 'results': _records(frame)}
+
+        ranked = pd.concat(matches, ignore_index=True) if matches else pd.DataFrame(columns=SCAN_COLUMNS)
+        if rank_by:
+            ranked = ranked.sort_values(rank_by, ascending=ascending, na_position='last')
+        yield {'type': 'done', 'scanned': len(symbols), 'ranked': _records(ranked)}
+
+    def _run(self, symbols, events, cancelled):
+        try:
+            self.ib_client._run_async(self._async_scan(symbols, events, cancelled))
+        except Exception as e:
+            print(f"Error running chain scan: {e}")
+            print(traceback.format_exc())
+        finally:
+            events.put(('done', None))
+
+    async def _async_scan(self, symbols, events, cancelled):
+        line_budget = LineBudget(self.max_lines)
+        in_flight = asyncio.Semaphore(MAX_SYMBOLS_IN_FLIGHT)
+        historical_pacer = RequestPacer(HISTORICAL_REQUEST_LIMIT, HISTORICAL_REQUEST_WINDOW)
+
+        async def scan_symbol(symbol):
+            try:
+                async with in_flight:
+                    if cancelled.is_set():
+                        return
+                    snapshot = await self.ib_client.async_get_chain_snapshot(
+                        symbol, self.min_dte, self.strike_count, line_budget)
+                if snapshot is None:
+                    events.put(('error', {'symbol': symbol, 'message': 'No usable option chain'}))
+                    return
+                # Waiting on historical pacing must not hold up other symbols' chain fetches
+                iv_rank = None
+                if self.with_iv_rank and not cancelled.is_set():
+                    iv_rank = await self._async_iv_rank(snapshot['stock'], historical_pacer)
+                events.put(('result', summarize_chain(symbol, snapshot, iv_rank)))
+            except Exception as e:
+                events.put(('error', {'symbol': symbol, 'message': str(e)}))
+
+        await asyncio.gather(*(scan_symbol(symbol) for symbol in symbols))
+
+    async def _async_iv_rank(self, stock, pacer):
+        """Where today's implied vol sits in its one-year range, 0-100"""
+        await pacer.acquire()
+
+        bars = await self.ib_client.ib.reqHistoricalDataAsync(
+            stock, '', '1 Y', '1 day', 'OPTION_IMPLIED_VOLATILITY', True)
+        if not bars:
+            return None
+        closes = np.array([bar.close for bar in bars], dtype=float)
+        low, high = np.nanmin(closes), np.nanmax(closes)
+        if high <= low:
+            return None
+        return float((closes[-1] - low) / (high - low) * 100)
+
+
+def _records(frame):
+    """DataFrame rows as JSON-safe dicts (NaN becomes None)"""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
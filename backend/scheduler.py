@@ -0,0 +1,271 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime
+
+try:
+    from zoneinfo import ZoneInfo
+    EXCHANGE_TZ = ZoneInfo('America/New_York')
+except ImportError:  # Python 3.8
+    import pytz
+    EXCHANGE_TZ = pytz.timezone('America/New_York')
+
+# Refresh intervals in seconds per market session
+PORTFOLIO_INTERVALS = {'regular': 15, 'extended': 30, 'closed': 300}
+OPTIONS_INTERVALS = {'regular': 5, 'extended': 15, 'closed': 300}
+
+# A key nobody has read for IDLE_AFTER seconds refreshes IDLE_FACTOR times slower
+IDLE_AFTER = 60
+IDLE_FACTOR = 4
+# Relative change per refresh at or above which data counts as fully volatile
+VOLATILE_CHANGE = 1e-3
+# Upper bound on the slowdown applied to data that isn't moving
+MAX_CALM_FACTOR = 4
+# Job bodies run on this many worker threads so one slow IB call can't stall the rest
+JOB_WORKERS = 4
+# A run taking longer than this (seconds) is reported as an overrun; ib_insync
+# requests have no timeout of their own, so a hung job keeps its worker
+JOB_TIMEOUT = 60
+
+
+def market_session(now=None):
+    """US equity session at `now`: 'regular', 'extended' or 'closed'
+
+    Exchange holidays are not modelled; they fall back to the weekday schedule.
+    """
+    now = now.astimezone(EXCHANGE_TZ) if now else datetime.now(EXCHANGE_TZ)
+    if now.weekday() >= 5:
+        return 'closed'
+    minutes = now.hour * 60 + now.minute
+    if 9 * 60 + 30 <= minutes < 16 * 60:
+        return 'regular'
+    if 4 * 60 <= minutes < 20 * 60:
+        return 'extended'
+    return 'closed'
+
+
+class RefreshJob:
+    def __init__(self, key, func, intervals, expire_after, on_expire=None):
+        self.key = key
+        self.func = func
+        self.intervals = intervals
+        self.expire_after = expire_after
+        self.on_expire = on_expire
+        self.last_read = time.monotonic()
+        self.last_value = None
+        self.volatility = VOLATILE_CHANGE
+        self.next_run = 0.0
+        self.runs = 0
+        self.started = None  # monotonic start of the run in progress
+        self.last_duration = None
+        self.overruns = 0
+        self._overrun_reported = False
+
+    def observe(self, value):
+        """Fold the relative change since the previous run into an EWMA"""
+        if value is None or value != value:
+            return
+        if self.last_value:
+            change = abs(value - self.last_value) / abs(self.last_value)
+            self.volatility = 0.7 * self.volatility + 0.3 * change
+        self.last_value = value
+
+    def interval(self, session, now):
+        base = self.intervals[session]
+        idle = IDLE_FACTOR if now - self.last_read > IDLE_AFTER else 1
+        if self.volatility <= 0:
+            calm = MAX_CALM_FACTOR
+        else:
+            calm = min(max(VOLATILE_CHANGE / self.volatility, 1), MAX_CALM_FACTOR)
+        return base * idle * calm
+
+
+class RefreshScheduler:
+    """Schedules every refresh job on one thread, ordered by a heap of due times
+
+    Each job's next delay is its per-session base interval, stretched when no
+    client has read the key recently and when its value has stopped moving.
+    A job returns a representative number (for example total NPV or spot)
+    that drives the volatility estimate. Jobs with `expire_after` are dropped
+    once nobody has read them for that long, calling their `on_expire`.
+
+    Due jobs run on JOB_WORKERS worker threads and are only rescheduled once
+    their run finishes, so a job never overlaps itself. Runs exceeding
+    JOB_TIMEOUT are counted as overruns and shown by `status`.
+    """
+
+    def __init__(self, session_func=market_session):
+        self.session_func = session_func
+        self.jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._queue = None
+        self._workers = []
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._queue = queue.Queue()
+            self._workers = []
+            for index in range(JOB_WORKERS):
+                worker = threading.Thread(target=self._work, args=(self._queue,),
+                                          name=f'refresh_worker_{index}')
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+            self._thread = threading.Thread(target=self._run, name='refresh_scheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+            work_queue, workers = self._queue, self._workers
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5.0)
+        # Workers finish their current run; a hung one is left behind as a daemon
+        if work_queue is not None:
+            for _ in workers:
+                work_queue.put(None)
+
+    def register(self, key, func, intervals, expire_after=None, on_expire=None):
+        """Add a job that runs right away; re-registering an existing key is a no-op"""
+        with self._cond:
+            if key in self.jobs:
+                return False
+            job = RefreshJob(key, func, intervals, expire_after, on_expire)
+            self.jobs[key] = job
+            self._push(job, time.monotonic())
+            return True
+
+    def unregister(self, key):
+        with self._cond:
+            self.jobs.pop(key, None)
+
+    def is_registered(self, key):
+        with self._cond:
+            return key in self.jobs
+
+    def touch(self, key):
+        """Record a client read; an idle job is pulled forward to its active rate"""
+        with self._cond:
+            job = self.jobs.get(key)
+            if job is None:
+                return
+            now = time.monotonic()
+            was_idle = now - job.last_read > IDLE_AFTER
+            job.last_read = now
+            if was_idle and job.runs:
+                due = now + job.intervals[self.session_func()]
+                if due < job.next_run:
+                    self._push(job, due)
+
+    def status(self):
+        # Jobs are added, expired and rescheduled by other threads under the lock
+        with self._cond:
+            now = time.monotonic()
+            jobs = [
+                {
+                    'key': job.key,
+                    'runs': job.runs,
+                    'next_run_in': round(max(job.next_run - now, 0), 1),
+                    'last_read_ago': round(now - job.last_read, 1),
+                    'volatility': job.volatility,
+                    'running_for': round(now - job.started, 1) if job.started is not None else None,
+                    'last_duration': round(job.last_duration, 3) if job.last_duration is not None else None,
+                    'overruns': job.overruns,
+                }
+                for job in self.jobs.values()
+            ]
+        return {'session': self.session_func(), 'jobs': jobs}
+
+    def _push(self, job, due):
+        # Older heap entries for the job are skipped when popped
+        job.next_run = due
+        heapq.heappush(self._heap, (due, next(self._seq), job.key))
+        self._cond.notify()
+
+    def _next_due_job(self):
+        """Block until a job is due and return it, or None when stopping"""
+        with self._cond:
+            while not self._stopping:
+                self._check_overruns()
+                if not self._heap:
+                    self._cond.wait(JOB_TIMEOUT)
+                    continue
+                due, _, key = self._heap[0]
+                job = self.jobs.get(key)
+                if job is None or job.next_run != due or job.started is not None:
+                    heapq.heappop(self._heap)
+                    continue
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(min(wait, JOB_TIMEOUT))
+                    continue
+                heapq.heappop(self._heap)
+                if job.expire_after and time.monotonic() - job.last_read > job.expire_after:
+                    del self.jobs[key]
+                    print(f"Refresh job '{key}' expired after no reads")
+                    if job.on_expire is not None:
+                        self._queue.put((job, True))
+                    continue
+                job.started = time.monotonic()
+                return job
+            return None
+
+    def _check_overruns(self):
+        now = time.monotonic()
+        for job in self.jobs.values():
+            if job.started is not None and not job._overrun_reported and now - job.started > JOB_TIMEOUT:
+                job._overrun_reported = True
+                job.overruns += 1
+                print(f"Refresh job '{job.key}' has been running for {now - job.started:.0f}s")
+
+    def _run(self):
+        while True:
+            job = self._next_due_job()
+            if job is None:
+                return
+            self._queue.put((job, False))
+
+    def _work(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            job, expired = item
+            if expired:
+                try:
+                    job.on_expire()
+                except Exception as e:
+                    print(f"Error expiring refresh job '{job.key}': {e}")
+                continue
+
+            value = None
+            try:
+                value = job.func()
+            except Exception as e:
+                print(f"Error in refresh job '{job.key}': {e}")
+                print(traceback.format_exc())
+
+            with self._cond:
+                now = time.monotonic()
+                job.last_duration = now - job.started
+                if job.last_duration > JOB_TIMEOUT and not job._overrun_reported:
+                    job.overruns += 1
+                job.started = None
+                job._overrun_reported = False
+                job.runs += 1
+                job.observe(value)
+                if self.jobs.get(job.key) is job:
+                    self._push(job, now + job.interval(self.session_func(), now))
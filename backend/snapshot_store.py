@@ -0,0 +1,124 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+DEFAULT_SNAPSHOT_PATH = os.environ.get(
+    'IB_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots.db')
+)
+# Snapshots not refreshed for this many days are dropped on load
+SNAPSHOT_MAX_AGE_DAYS = float(os.environ.get('IB_SNAPSHOT_MAX_AGE_DAYS', 7))
+
+
+class SnapshotStore:
+    """Write-behind persistence of the latest JSON snapshot per key in SQLite
+
+    `save` only records the newest value for a key and wakes the writer
+    thread, so a refresh never waits on disk. The writer commits all pending
+    keys in one transaction; SQLite's journal makes each commit atomic, so a
+    crash mid-write leaves the previous snapshots intact.
+    """
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH):
+        self.path = path
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS snapshots ('
+                'key TEXT PRIMARY KEY, data TEXT NOT NULL, saved_at TEXT NOT NULL)'
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def load_all(self, max_age_days=SNAPSHOT_MAX_AGE_DAYS):
+        """Return {key: (data, saved_at)} for every stored snapshot
+
+        Snapshots older than max_age_days are deleted instead of returned.
+        """
+        snapshots = {}
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat()
+        try:
+            with contextlib.closing(self._connect()) as conn:
+                with conn:
+                    removed = conn.execute('DELETE FROM snapshots WHERE saved_at < ?', (cutoff,)).rowcount
+                if removed:
+                    print(f"Pruned {removed} snapshots older than {max_age_days:g} days")
+                for key, data, saved_at in conn.execute('SELECT key, data, saved_at FROM snapshots'):
+                    try:
+                        snapshots[key] = (json.loads(data), saved_at)
+                    except ValueError:
+                        print(f"Skipping unreadable snapshot '{key}'")
+        except sqlite3.Error as e:
+            print(f"Error loading snapshots: {e}")
+        return snapshots
+
+    def delete(self, keys):
+        """Remove snapshots that should not be served again"""
+        keys = list(keys)
+        if not keys:
+            return
+        with self._cond:
+            for key in keys:
+                self._pending.pop(key, None)
+        try:
+            with contextlib.closing(self._connect()) as conn, conn:
+                conn.executemany('DELETE FROM snapshots WHERE key = ?', [(key,) for key in keys])
+        except sqlite3.Error as e:
+            print(f"Error deleting snapshots: {e}")
+
+    def save(self, key, data):
+        """Queue the latest value of `key` for the writer thread"""
+        payload = json.dumps(data)
+        with self._cond:
+            self._pending[key] = (payload, datetime.now().isoformat())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='snapshot_writer')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def close(self):
+        """Write out anything still pending and stop the writer thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5.0)
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                with self._cond:
+                    while not self._pending and not self._stopping:
+                        self._cond.wait()
+                    pending, self._pending = self._pending, {}
+                    stopping = self._stopping
+                if pending:
+                    self._write(conn, pending)
+                if stopping:
+                    break
+        finally:
+            conn.close()
+
+    def _write(self, conn, pending):
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO snapshots (key, data, saved_at) VALUES (?, ?, ?)',
+                    [(key, payload, saved_at) for key, (payload, saved_at) in pending.items()]
+                )
+        except sqlite3.Error as e:
+            print(f"Error writing snapshots: {e}")
+            print(traceback.format_exc())
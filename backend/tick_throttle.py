@@ -0,0 +1,80 @@
+import os
+import threading
+import traceback
+
+# Default flush cadence for coalesced ticks
+DEFAULT_FLUSH_HZ = float(os.environ.get('IB_TICK_FLUSH_HZ', 4))
+
+
+class TickCoalescer:
+    """Collapses bursts of ticker updates to the latest state per conId
+
+    ib_insync fires `pendingTickersEvent` once per network batch with every
+    ticker that changed. Instead of recomputing downstream state on each
+    batch, the tickers are kept in a dirty set keyed by conId (the Ticker
+    object is updated in place, so the latest entry is the latest state) and
+    listeners are called with that set at most `flush_hz` times per second.
+    """
+
+    def __init__(self, ib, flush_hz=DEFAULT_FLUSH_HZ):
+        self.ib = ib
+        self.interval = 1.0 / flush_hz
+        self.ticks_received = 0
+        self.tickers_flushed = 0
+        self._dirty = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        """Register a callable that receives a {conId: Ticker} dict on each flush"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.ib.pendingTickersEvent += self._on_pending_tickers
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='tick_coalescer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.ib.pendingTickersEvent -= self._on_pending_tickers
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._dirty = {}
+
+    def _on_pending_tickers(self, tickers):
+        with self._lock:
+            for ticker in tickers:
+                self._dirty[ticker.contract.conId] = ticker
+            self.ticks_received += len(tickers)
+
+    def flush(self):
+        """Hand the current dirty set to every listener; returns its size"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+        self.tickers_flushed += len(dirty)
+        for listener in list(self._listeners):
+            try:
+                listener(dirty)
+            except Exception as e:
+                print(f"Error in tick listener: {e}")
+                print(traceback.format_exc())
+        return len(dirty)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()